@@ -0,0 +1,21 @@
+"""Writes files so that a crash, or a full disk, leaves either the old file
+or the new one, never half of one."""
+import os
+import tempfile
+
+
+def write_atomic(path, write, mode="w"):
+    """Calls write(out_file) on a temporary file next to path, flushes it
+    to disk, then renames it into place. mode is "w" for text, which is
+    written without newline translation, or "wb" for bytes."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".partial")
+    try:
+        with os.fdopen(fd, mode, newline="" if "b" not in mode else None) as out_file:
+            write(out_file)
+            out_file.flush()
+            os.fsync(out_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,288 @@
+"""Headless batch mode. Processes many videos without ever building a Tk window.
+
+Usage:
+    python batch.py --line-pos 960 --theta 2.5 --direction rtl *.mp4
+
+python main.py batch takes the same arguments.
+
+For every video a PNG of the result and a JSON timing sidecar are written.
+With --stitch, the videos are the consecutive parts of one recording and get
+one result between them.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import json
+from multiprocessing import freeze_support
+import os
+import sys
+import time
+
+from dateutil.relativedelta import relativedelta
+
+from export import write_png
+from processing import VideoInfo, parse_seconds, process_files, process_video
+
+
+def parse_roi(text):
+    """Parses "TOP:BOTTOM" into a (top, bottom) pair of rows"""
+    try:
+        top, bottom = (int(part) for part in text.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("must be given as TOP:BOTTOM, e.g. 300:900")
+    if bottom <= top:
+        raise argparse.ArgumentTypeError("BOTTOM must be below TOP")
+    return top, bottom
+
+
+def parse_args(argv, prog="main.py batch"):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="Create photo finish images from videos without the GUI.",
+    )
+    parser.add_argument("files", nargs="+", help="Video files to process")
+    parser.add_argument(
+        "--line-pos",
+        type=int,
+        action="append",
+        help=(
+            "x position of the finish line in the rotated video. Defaults to the "
+            "centre. Repeat to extract several lines in one pass."
+        ),
+    )
+    parser.add_argument(
+        "--theta",
+        type=float,
+        action="append",
+        help=(
+            "Tilt of the finish line in degrees, as shown by the GUI. Repeat to "
+            "give each --line-pos its own tilt."
+        ),
+    )
+    parser.add_argument(
+        "--rotation",
+        type=int,
+        default=0,
+        choices=[-270, -180, -90, 0, 90, 180, 270],
+        help="Counter clockwise rotation of the video in degrees",
+    )
+    parser.add_argument(
+        "--direction",
+        choices=["ltr", "rtl"],
+        default="ltr",
+        help="Direction of travel, left to right or right to left",
+    )
+    parser.add_argument(
+        "--utc-offset",
+        type=int,
+        default=-7,
+        help="UTC offset of the timezone the videos were recorded in",
+    )
+    parser.add_argument(
+        "--fps", type=float, help="Override the capture frame rate from the metadata"
+    )
+    parser.add_argument(
+        "--interpolation", choices=["nearest", "bilinear"], default="bilinear"
+    )
+    parser.add_argument(
+        "--start",
+        type=parse_seconds,
+        help="Only process the video from this time, in seconds or mm:ss",
+    )
+    parser.add_argument(
+        "--end",
+        type=parse_seconds,
+        help="Only process the video up to this time, in seconds or mm:ss",
+    )
+    parser.add_argument(
+        "--roi",
+        type=parse_roi,
+        help=(
+            "Only extract the rows between TOP:BOTTOM of the rotated video, e.g. "
+            "300:900"
+        ),
+    )
+    parser.add_argument(
+        "--downscale",
+        type=int,
+        default=1,
+        help="Keep one row in every DOWNSCALE rows of the result",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["auto", "inline", "thread", "process"],
+        default="auto",
+        help=(
+            "Where frames are processed. By default the fastest is picked from "
+            "the frame size, lines and number of cores."
+        ),
+    )
+    parser.add_argument(
+        "--stitch",
+        action="store_true",
+        help=(
+            "Process the videos as consecutive parts of one recording, in the "
+            "order given, into one result"
+        ),
+    )
+    parser.add_argument(
+        "--disk-backed",
+        action="store_true",
+        help="Build results in a memory-mapped temporary file instead of RAM",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print per-stage timings and add them to the sidecar",
+    )
+    parser.add_argument(
+        "--output-dir", help="Where to write results. Defaults to next to each video"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of videos to process at the same time",
+    )
+    args = parser.parse_args(argv)
+    if args.stitch and (args.start or args.end is not None):
+        parser.error("--start and --end can't be used with --stitch")
+
+    # Windows shells don't expand wildcards for us
+    files = []
+    for pattern in args.files:
+        files.extend(sorted(glob.glob(pattern)) or [pattern])
+    args.files = files
+    return args
+
+
+def process_file(files, args, workers):
+    """Processes one video, or the consecutive parts of one, and writes a PNG
+    and timing sidecar for each of its lines, named after the first file.
+    Runs in a worker process."""
+    start = time.time()
+    file = files[0]
+    info = VideoInfo(file, utc_offset=args.utc_offset)
+    fps = args.fps or info.fps
+
+    if args.rotation % 180:
+        width = info.frame_height
+    else:
+        width = info.frame_width
+    line_positions = args.line_pos or [width // 2]
+    thetas = args.theta or [0]
+    # Lines without their own --theta take the last one given
+    thetas = thetas + thetas[-1:] * (len(line_positions) - len(thetas))
+    lines = list(zip(line_positions, thetas))
+    direction = 1 if args.direction == "ltr" else -1
+
+    options = dict(
+        interpolation=args.interpolation,
+        disk_backed=args.disk_backed,
+        workers=workers,
+        backend=args.backend,
+        roi=args.roi,
+        downscale=args.downscale,
+    )
+    if len(files) > 1:
+        processed = process_files(files, lines, args.rotation, direction, **options)
+    else:
+        processed = process_video(
+            file,
+            lines,
+            args.rotation,
+            direction,
+            start_seconds=args.start,
+            end_seconds=args.end,
+            **options,
+        )
+    start_time = info.start_time
+    if start_time:
+        start_time += relativedelta(seconds=processed.first_frame / fps)
+
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(file))
+    name = os.path.splitext(os.path.basename(file))[0]
+    sidecars = []
+    for i, ((line_pos, theta), result_array) in enumerate(
+        zip(lines, processed.result_arrays)
+    ):
+        line_name = f"{name}-line{i + 1}" if len(lines) > 1 else name
+        image_file = os.path.join(output_dir, f"{line_name}.png")
+        # Written a strip at a time, so a disk-backed result is never copied
+        # into memory whole
+        write_png(result_array, image_file)
+
+        height, num_frames = result_array.shape[:2]
+        sidecar = {
+            "video": os.path.abspath(file),
+            "image": os.path.abspath(image_file),
+            # The time at the time origin column is start_time. Every column
+            # away from it adds seconds_per_pixel.
+            "start_time": start_time.isoformat() if start_time else None,
+            "first_frame": processed.first_frame,
+            "fps": fps,
+            "seconds_per_pixel": 1 / fps,
+            "time_origin_column": num_frames if direction > 0 else 0,
+            "direction": direction,
+            "width": num_frames,
+            "height": height,
+            "line_pos": line_pos,
+            "theta": theta,
+            "rotation": args.rotation,
+            "roi": list(args.roi) if args.roi else None,
+            "downscale": args.downscale,
+            "processing_seconds": round(time.time() - start, 3),
+        }
+        if len(files) > 1:
+            sidecar["videos"] = [os.path.abspath(part) for part in files]
+        if args.profile:
+            sidecar["profile"] = processed.stats.report()
+        sidecar_file = os.path.join(output_dir, f"{line_name}.json")
+        with open(sidecar_file, "w") as out_file:
+            json.dump(sidecar, out_file, indent=2)
+        sidecars.append(sidecar)
+
+    if args.profile:
+        print(f"{file}:\n{processed.stats.format()}")
+    return sidecars
+
+
+def main(argv, prog="main.py batch"):
+    args = parse_args(argv, prog)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    if args.stitch:
+        groups = [args.files]
+    else:
+        groups = [[file] for file in args.files]
+    jobs = max(1, min(args.jobs, len(groups)))
+    # Split the cores between the videos being processed at the same time
+    workers = max(1, (os.cpu_count() or 1) // jobs)
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(process_file, files, args, workers): files[0]
+            for files in groups
+        }
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                sidecars = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"{file}: failed. {e}")
+            else:
+                for sidecar in sidecars:
+                    print(
+                        f"{file}: {sidecar['width']} frames in "
+                        f"{sidecar['processing_seconds']} s -> {sidecar['image']}"
+                    )
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    freeze_support()
+    sys.exit(main(sys.argv[1:], prog="batch.py"))
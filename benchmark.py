@@ -0,0 +1,304 @@
+"""Reproducible benchmarks for the frame to photo finish pipeline.
+
+Synthetic test videos are generated with PyAV, then run through the headless
+processing core with straight and tilted lines in both directions. Each case
+runs in a fresh process so that its peak memory can be measured on its own,
+and is repeated so that its best time can be compared between runs. Every
+column of a test video has something in it, so a case that leaves any
+column blank has lost frames, and fails the run.
+
+Usage:
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json --output new.json
+
+Run python benchmark.py --help for the options that narrow the matrix down.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import av
+import numpy as np
+
+from processing import process_video
+
+
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "4k": (3840, 2160),
+}
+
+FRAME_RATES = [30, 60, 120, 240]
+
+CODECS = ["libx264", "mpeg4", "libx265"]
+
+# MPEG-TS and Matroska seek and time their frames differently from MP4, and
+# are what cameras recording in chunks and live streams usually write
+CONTAINERS = ["mp4", "ts", "mkv"]
+
+# Cases slower than this, relative to the baseline, are reported as regressions
+REGRESSION_THRESHOLD = 0.1
+
+# Times each case is run. The fastest run is the least disturbed by whatever
+# else the machine was doing, so that is what is compared.
+REPEATS = 5
+
+
+def generate_video(path, width, height, fps, codec, seconds):
+    """Writes a synthetic video of a bright bar sweeping across a gradient,
+    so that every column of the result differs"""
+    container = av.open(path, "w")
+    try:
+        stream = container.add_stream(codec, rate=fps)
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = "yuv420p"
+        # A keyframe every half second, so even a one second video can be
+        # split up by the process backend
+        stream.codec_context.gop_size = max(fps // 2, 1)
+
+        background = np.empty((height, width, 3), dtype=np.uint8)
+        background[:, :, 0] = np.linspace(0, 255, width, dtype=np.uint8)[np.newaxis, :]
+        background[:, :, 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, np.newaxis]
+        background[:, :, 2] = 64
+        num_frames = int(fps * seconds)
+        bar_width = max(width // 50, 1)
+        for i in range(num_frames):
+            array = background.copy()
+            x = i * (width - bar_width) // max(num_frames - 1, 1)
+            array[:, x:x + bar_width] = 255
+            frame = av.VideoFrame.from_ndarray(array, format="rgb24")
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    finally:
+        container.close()
+
+
+def get_video(cache_dir, resolution, fps, codec, container, seconds):
+    """Returns the path of a test video, generating it if it isn't cached"""
+    width, height = RESOLUTIONS[resolution]
+    path = os.path.join(
+        cache_dir, f"{resolution}-{fps}fps-{codec}-{seconds}s.{container}"
+    )
+    if not os.path.exists(path):
+        print(f"Generating {path}")
+        partial = f"{path}.partial.{container}"
+        generate_video(partial, width, height, fps, codec, seconds)
+        os.replace(partial, path)
+    return path
+
+
+def peak_rss_bytes(children=False):
+    """Returns the peak resident set size of this process or of its largest
+    child, in bytes. Returns None where the resource module is missing."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(video, theta, direction, backend, workers, repeats=REPEATS):
+    """Processes one video repeats times in a fresh process and returns its
+    measurements, timed by the fastest run"""
+    container = av.open(video)
+    width = container.streams.video[0].codec_context.width
+    container.close()
+
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        processed = process_video(
+            video,
+            [(width // 2, theta)],
+            0,
+            direction,
+            backend=backend,
+            workers=workers,
+        )
+        runs.append(time.perf_counter() - start)
+    seconds = min(runs)
+    frames = processed.stats.frames
+    # Every column of a test video has something in it, so a blank one is a
+    # frame that was lost, e.g. to a seek landing past it
+    blank_columns = sum(
+        int(np.count_nonzero(array.max(axis=(0, 2)) == 0))
+        for array in processed.result_arrays
+    )
+    return {
+        "seconds": round(seconds, 4),
+        "median_seconds": round(float(np.median(runs)), 4),
+        "runs": len(runs),
+        "frames": frames,
+        "frames_per_second": round(frames / seconds, 2),
+        "blank_columns": blank_columns,
+        "backend": processed.stats.backend,
+        "ipc_bytes": processed.stats.ipc_bytes,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "peak_worker_rss_bytes": peak_rss_bytes(children=True),
+        "profile": processed.stats.report(),
+    }
+
+
+def environment():
+    """Describes the machine and revision the benchmark ran on"""
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        revision = None
+    return {
+        "revision": revision or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "av": av.__version__,
+        "numpy": np.__version__,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results, baseline):
+    """Prints the change in throughput of every case against a baseline, by
+    their fastest runs. Returns the number of regressions."""
+    baseline_cases = {case["name"]: case for case in baseline["cases"]}
+    regressions = 0
+    for case in results["cases"]:
+        old = baseline_cases.get(case["name"])
+        if not old:
+            print(f"{case['name']}: new")
+            continue
+        change = case["frames_per_second"] / old["frames_per_second"] - 1
+        flag = ""
+        if change < -REGRESSION_THRESHOLD:
+            flag = "  <-- regression"
+            regressions += 1
+        print(f"{case['name']}: {change:+.1%} frames/s{flag}")
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--resolutions", nargs="+", choices=list(RESOLUTIONS), default=list(RESOLUTIONS)
+    )
+    parser.add_argument("--fps", nargs="+", type=int, default=FRAME_RATES)
+    parser.add_argument("--codecs", nargs="+", default=CODECS)
+    parser.add_argument(
+        "--containers", nargs="+", choices=CONTAINERS, default=CONTAINERS
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=2, help="Length of each test video"
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=["auto", "inline", "thread", "process"],
+        default=["inline", "thread", "process"],
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=REPEATS, help="Runs of each case"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="Workers per case"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".benchmark-videos"),
+        help="Where generated test videos are kept between runs",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare against a baseline JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    os.makedirs(args.cache_dir, exist_ok=True)
+
+    codecs = []
+    for codec in args.codecs:
+        try:
+            av.codec.Codec(codec, "w")
+        except Exception:
+            print(f"Skipping {codec}, it isn't available in this build of ffmpeg")
+        else:
+            codecs.append(codec)
+
+    results = {"environment": environment(), "cases": []}
+    names = set()
+    failures = 0
+    # A fresh process per case, so peak memory is measured per case. Linux
+    # keeps the peak across exec, so the parent must stay small too and
+    # videos are generated in a child as well.
+    context = multiprocessing.get_context("spawn")
+    for resolution, fps, codec, container in itertools.product(
+        args.resolutions, args.fps, codecs, args.containers
+    ):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            video = executor.submit(
+                get_video, args.cache_dir, resolution, fps, codec, container,
+                args.seconds,
+            ).result()
+        for backend, theta, direction in itertools.product(
+            args.backends, [0, 5], [1, -1]
+        ):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                case = executor.submit(
+                    run_case, video, theta, direction, backend, args.workers,
+                    args.repeats,
+                ).result()
+            # Named by the backend that actually ran, which isn't the one
+            # asked for when a backend falls back to another
+            name = (
+                f"{resolution}-{fps}fps-{codec}-{container}-{case['backend']}-"
+                f"{'tilted' if theta else 'straight'}-"
+                f"{'ltr' if direction > 0 else 'rtl'}"
+            )
+            if case["backend"] != backend and name in names:
+                print(f"{name}: {backend} ran as {case['backend']}, skipped")
+                continue
+            names.add(name)
+            case["name"] = name
+            results["cases"].append(case)
+            peak = case["peak_rss_bytes"]
+            print(
+                f"{name}: {case['frames_per_second']} frames/s ({case['backend']}), "
+                f"{f'{peak / 2**20:.0f} MiB' if peak else 'unknown'} peak, "
+                f"{case['ipc_bytes'] / 2**20:.1f} MiB between processes"
+            )
+            if case["blank_columns"]:
+                print(f"{name}: {case['blank_columns']} blank columns  <-- failure")
+                failures += 1
+
+    if args.output:
+        with open(args.output, "w") as out_file:
+            json.dump(results, out_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as in_file:
+            baseline = json.load(in_file)
+        failures += compare(results, baseline)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,202 @@
+"""The store of finish times entered by bib number.
+
+Entries are kept sorted by time as they are added, so adding one never
+re-sorts the whole list. Every change is appended to a journal next to the
+CSV and flushed to disk straight away, and the CSV itself is only rewritten
+every so often. The CSV is always replaced in one step, so a crash can't
+leave it half written, and the journal holds everything entered since the
+last rewrite."""
+import bisect
+import csv
+import os
+import time
+
+from atomic import write_atomic
+
+
+DEFAULT_BIB_TIMES_FILENAME = "bib_times.csv"
+
+# Rewrite the CSV after this many changes, or once this many seconds have
+# passed since it was last written, whichever comes first
+COMPACT_EVERY = 100
+COMPACT_SECONDS = 10
+
+
+class CompactionError(Exception):
+    """The change was saved to the journal, but the CSV couldn't be
+    rewritten"""
+
+
+class BibTimes:
+    def __init__(self, bib_results_filename=DEFAULT_BIB_TIMES_FILENAME):
+        # (bib, time) tuples sorted by time. Times are "%H:%M:%S.%f" strings,
+        # which sort in time order.
+        self.bib_times = []
+        # Sorted times of every bib, for lookups by bib number
+        self.times_by_bib = {}
+        self.journal = None
+        self.changes = 0
+        self.compacted_at = time.monotonic()
+        self._bib_results_filename = bib_results_filename
+        self.recover()
+
+    @property
+    def bib_results_filename(self):
+        return self._bib_results_filename
+
+    @bib_results_filename.setter
+    def bib_results_filename(self, filename):
+        """Moves the times to a new CSV"""
+        if filename == self._bib_results_filename:
+            return
+        self.close()
+        self._bib_results_filename = filename
+        self.recover()
+        if self.bib_times:
+            self.compact()
+
+    @property
+    def csv_path(self):
+        try:
+            filename, extension = self.bib_results_filename.split(".")
+        except Exception:
+            filename = self.bib_results_filename
+            extension = "csv"
+        return f"{filename}.csv"
+
+    @property
+    def journal_path(self):
+        return f"{self.csv_path}.journal"
+
+    def __len__(self):
+        return len(self.bib_times)
+
+    def find(self, bib):
+        """Returns the times entered for a bib, earliest first"""
+        return list(self.times_by_bib.get(bib, []))
+
+    def add(self, bib_time):
+        """Adds a (bib, time) entry"""
+        self.write_journal([("add", *bib_time)])
+        self.insert(*bib_time)
+        self.changed()
+
+    def remove(self, bib, bib_time):
+        """Removes the entry of a bib at a time. Raises KeyError if there is
+        no such entry."""
+        if bib_time not in self.times_by_bib.get(bib, []):
+            raise KeyError((bib, bib_time))
+        self.write_journal([("remove", bib, bib_time)])
+        self.delete(bib, bib_time)
+        self.changed()
+
+    def correct(self, bib, old_time, new_time=None, new_bib=None):
+        """Changes the time or bib number of an entry. Raises KeyError if
+        there is no such entry."""
+        if old_time not in self.times_by_bib.get(bib, []):
+            raise KeyError((bib, old_time))
+        new_time = new_time or old_time
+        new_bib = new_bib or bib
+        # Both records go in one write, so the journal never holds half a
+        # correction
+        self.write_journal([("remove", bib, old_time), ("add", new_bib, new_time)])
+        self.delete(bib, old_time)
+        self.insert(new_bib, new_time)
+        self.changed()
+
+    def insert(self, bib, bib_time):
+        bisect.insort(self.bib_times, (bib, bib_time), key=lambda entry: entry[1])
+        bisect.insort(self.times_by_bib.setdefault(bib, []), bib_time)
+
+    def delete(self, bib, bib_time):
+        i = bisect.bisect_left(self.bib_times, bib_time, key=lambda entry: entry[1])
+        while self.bib_times[i] != (bib, bib_time):
+            i += 1
+        del self.bib_times[i]
+        times = self.times_by_bib[bib]
+        times.remove(bib_time)
+        if not times:
+            del self.times_by_bib[bib]
+
+    def write_journal(self, records):
+        if self.journal is None:
+            self.journal = open(self.journal_path, "a", newline="")
+        csv.writer(self.journal).writerows(records)
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def changed(self):
+        self.changes += 1
+        self.compact_if_due()
+
+    def compact_if_due(self):
+        """Rewrites the CSV if enough has changed since it was last written,
+        or if anything has and it was written long enough ago. Called after
+        every change, and every COMPACT_SECONDS by the UI so that the last
+        few changes don't wait for the next one."""
+        if self.changes and (
+            self.changes >= COMPACT_EVERY
+            or time.monotonic() - self.compacted_at >= COMPACT_SECONDS
+        ):
+            self.compact()
+
+    def compact(self):
+        """Rewrites the CSV from the in-memory entries, then starts a new
+        journal. Raises CompactionError if the CSV can't be written, e.g.
+        because it is open in another program. The journal is kept, and the
+        CSV is written again on the next change."""
+        try:
+            write_atomic(
+                self.csv_path,
+                lambda out_file: out_file.writelines(
+                    f"{bib}, {bib_time}\n" for bib, bib_time in self.bib_times
+                ),
+            )
+        except OSError as e:
+            raise CompactionError(e) from e
+
+        # Start the journal over with a snapshot of every entry. Until it is
+        # in place the old journal still describes everything.
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        write_atomic(
+            self.journal_path,
+            lambda out_file: csv.writer(out_file).writerows(
+                ("add", bib, bib_time) for bib, bib_time in self.bib_times
+            ),
+        )
+        self.changes = 0
+        self.compacted_at = time.monotonic()
+
+    def recover(self):
+        """Replays the journal left behind if the app didn't close cleanly"""
+        try:
+            in_file = open(self.journal_path, newline="")
+        except FileNotFoundError:
+            return
+        with in_file:
+            for record in csv.reader(in_file):
+                # The last record may have been cut short by a crash
+                if len(record) != 3:
+                    continue
+                op, bib, bib_time = record
+                if op == "add":
+                    self.insert(bib, bib_time)
+                elif op == "remove" and bib_time in self.times_by_bib.get(bib, []):
+                    self.delete(bib, bib_time)
+
+    def close(self):
+        """Writes the CSV and removes the journal, which is only needed to
+        recover from a crash"""
+        # A journal means the CSV may be out of date, even if every entry
+        # has since been removed
+        if self.bib_times or os.path.exists(self.journal_path):
+            self.compact()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,189 @@
+"""An on-disk cache of finished results, so that reopening a video that has
+already been processed, or restarting after a crash, doesn't mean decoding it
+all over again.
+
+Entries are keyed by the identity of the video file and every parameter that
+changes the result. Each entry is one .npy file per finish line plus a small
+metadata file, and the least recently used entries are evicted once the cache
+grows past its size cap."""
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+
+from atomic import write_atomic
+from processing import ProcessedVideo
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".finishline", "cache")
+
+# Default size cap of the cache, in bytes
+DEFAULT_MAX_BYTES = 4 * 2**30
+
+# Bytes hashed from each end of a video to tell it apart from another file
+# with the same size and modification time
+IDENTITY_CHUNK = 2**20
+
+
+def file_identity(file):
+    """Returns a fingerprint of a video file that changes whenever the file
+    does, without reading all of it. Raises OSError if the file can't be
+    read."""
+    stat = os.stat(file)
+    digest = hashlib.sha256()
+    with open(file, "rb") as in_file:
+        digest.update(in_file.read(IDENTITY_CHUNK))
+        if stat.st_size > IDENTITY_CHUNK:
+            in_file.seek(max(stat.st_size - IDENTITY_CHUNK, IDENTITY_CHUNK))
+            digest.update(in_file.read(IDENTITY_CHUNK))
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "partial_hash": digest.hexdigest(),
+    }
+
+
+class ResultCache:
+    """A size capped, least recently used cache of ProcessedVideos"""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(
+        self, file, lines, rotation, direction, interpolation="bilinear",
+        start_seconds=None, end_seconds=None, roi=None, downscale=1,
+    ):
+        """Returns the cache key of processing a video with these parameters.
+        file may also be a list of consecutive videos processed as one.
+        Raises OSError if a video can't be read."""
+        if isinstance(file, (list, tuple)):
+            identity = [file_identity(part) for part in file]
+        else:
+            identity = file_identity(file)
+        parameters = {
+            "file": identity,
+            "lines": [[line_pos, theta] for line_pos, theta in lines],
+            "rotation": rotation,
+            "direction": direction,
+            "interpolation": interpolation,
+            "start_seconds": start_seconds,
+            "end_seconds": end_seconds,
+            "roi": list(roi) if roi else None,
+            "downscale": downscale,
+        }
+        encoded = json.dumps(parameters, sort_keys=True).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def metadata_path(self, key):
+        return os.path.join(self.directory, f"{key}.meta")
+
+    def array_path(self, key, i):
+        return os.path.join(self.directory, f"{key}-{i}.npy")
+
+    def get(self, key):
+        """Returns the cached ProcessedVideo, or None on a miss. The result
+        arrays are memory-mapped read only, so even very long results open
+        instantly."""
+        metadata_path = self.metadata_path(key)
+        try:
+            with open(metadata_path, "rb") as in_file:
+                metadata = pickle.load(in_file)
+            result_arrays = [
+                np.load(self.array_path(key, i), mmap_mode="r")
+                for i in range(metadata["num_lines"])
+            ]
+            # Mark the entry as recently used
+            os.utime(metadata_path)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+        return ProcessedVideo(
+            result_arrays,
+            metadata["first_frame"],
+            metadata["stats"],
+            metadata.get("index"),
+        )
+
+    def put(self, key, processed):
+        """Stores a ProcessedVideo, then evicts old entries if the cache is
+        over its size cap. Results larger than the cap aren't stored."""
+        size = sum(array.nbytes for array in processed.result_arrays)
+        if size > self.max_bytes:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # The metadata is written last, so a half written entry is never read
+        for i, array in enumerate(processed.result_arrays):
+            write_atomic(
+                self.array_path(key, i),
+                lambda out_file: np.save(out_file, array),
+                mode="wb",
+            )
+        self.write_metadata(key, len(processed.result_arrays), processed)
+        self.evict()
+
+    def adopt(self, key, paths, processed):
+        """Stores a ProcessedVideo whose result arrays are already saved as
+        the .npy files at paths, by moving the files into the cache instead
+        of writing them out again. Returns False, leaving the files where
+        they are, if they are over the size cap. Raises OSError if they
+        can't be moved, e.g. because the cache is on another drive."""
+        size = sum(os.path.getsize(path) for path in paths)
+        if size > self.max_bytes:
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        for i, path in enumerate(paths):
+            os.replace(path, self.array_path(key, i))
+        self.write_metadata(key, len(paths), processed)
+        self.evict()
+        return True
+
+    def write_metadata(self, key, num_lines, processed):
+        metadata = {
+            "num_lines": num_lines,
+            "first_frame": processed.first_frame,
+            "stats": processed.stats,
+            "index": processed.index,
+        }
+        write_atomic(
+            self.metadata_path(key),
+            lambda out_file: pickle.dump(metadata, out_file),
+            mode="wb",
+        )
+
+    def has(self, key):
+        return os.path.exists(self.metadata_path(key))
+
+    def entries(self):
+        """Returns (last_used, size, key) of every entry, oldest first"""
+        sizes = {}
+        last_used = {}
+        for entry in os.scandir(self.directory):
+            name, extension = os.path.splitext(entry.name)
+            stat = entry.stat()
+            key = name.split("-")[0]
+            sizes[key] = sizes.get(key, 0) + stat.st_size
+            if extension == ".meta":
+                last_used[key] = stat.st_mtime
+        # Files without metadata are from an interrupted write, evict them
+        # first
+        return sorted(
+            (last_used.get(key, 0), size, key) for key, size in sizes.items()
+        )
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in
+        max_bytes"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for entry in os.scandir(self.directory):
+                if entry.name.split("-")[0].split(".")[0] == key:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+            total -= size
@@ -0,0 +1,317 @@
+"""Checkpoints of results being processed, so that a run interrupted part way
+through, by a crash, a cancel or the laptop going to sleep, carries on where
+it stopped when the same video is processed again with the same settings.
+
+A checkpoint is a directory per cache key, holding a memory-mapped .npy file
+per finish line that frames are written straight into, and a manifest of
+the frames that are done. The video is processed in keyframe aligned chunks,
+and the manifest is only updated once a chunk has been flushed to disk, so
+every frame it lists is really there."""
+import json
+import os
+import shutil
+import time
+
+import av
+import numpy as np
+
+from atomic import write_atomic
+from processing import (
+    ProcessedVideo, ProcessingStats, StitchedIndex, VideoIndex, choose_backend,
+    extract_file, make_samplers, process_files, process_video,
+)
+
+
+DEFAULT_CHECKPOINT_DIR = os.path.join(
+    os.path.expanduser("~"), ".finishline", "checkpoints"
+)
+
+# Frames processed between checkpoints. The process backend does this many
+# per worker, so starting its processes for every chunk stays cheap.
+CHECKPOINT_FRAMES = 5000
+
+# Runs shorter than this many chunks aren't checkpointed, as losing them
+# costs less than writing them out
+MIN_CHECKPOINT_CHUNKS = 2
+
+# Checkpoints of runs that were never finished are removed after this long
+MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+
+
+class Checkpoint:
+    """The result arrays of one run, and the [start, stop) ranges of frames
+    in them that are done"""
+
+    def __init__(self, key, shapes, root=DEFAULT_CHECKPOINT_DIR):
+        """Opens the checkpoint of key, or starts a new one if there is none
+        with result arrays of these shapes"""
+        self.directory = os.path.join(root, key)
+        self.manifest_path = os.path.join(self.directory, "manifest.json")
+        self.shapes = [list(shape) for shape in shapes]
+        self.paths = [
+            os.path.join(self.directory, f"{i}.npy") for i in range(len(shapes))
+        ]
+        self.done = self.load()
+        if self.done is not None:
+            try:
+                self.arrays = [np.load(path, mmap_mode="r+") for path in self.paths]
+                # Keep it from being pruned while it is in use
+                os.utime(self.directory)
+                return
+            except (OSError, ValueError):
+                pass
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+        self.arrays = [
+            np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=shape)
+            for path, shape in zip(self.paths, shapes)
+        ]
+        self.done = []
+        self.write_manifest()
+
+    def load(self):
+        """Returns the frames done according to the manifest, or None if
+        there is no usable manifest"""
+        try:
+            with open(self.manifest_path) as in_file:
+                manifest = json.load(in_file)
+            if manifest["shapes"] != self.shapes:
+                return None
+            return [(start, stop) for start, stop in manifest["done"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def write_manifest(self):
+        """Writes the manifest so that a crash leaves either the old or the
+        new one"""
+        manifest = {"shapes": self.shapes, "done": self.done}
+        write_atomic(self.manifest_path, lambda out_file: json.dump(manifest, out_file))
+
+    def frames_done(self):
+        return sum(stop - start for start, stop in self.done)
+
+    def remaining(self, num_frames):
+        """Returns the [start, stop) ranges of frames still to do"""
+        ranges = []
+        position = 0
+        for start, stop in self.done:
+            if start > position:
+                ranges.append((position, start))
+            position = max(position, stop)
+        if position < num_frames:
+            ranges.append((position, num_frames))
+        return ranges
+
+    def mark_done(self, start, stop):
+        """Flushes the result arrays to disk, then records frames start to
+        stop - 1 as done"""
+        for array in self.arrays:
+            array.flush()
+        ranges = sorted(self.done + [(start, stop)])
+        self.done = ranges[:1]
+        for range_start, range_stop in ranges[1:]:
+            if range_start <= self.done[-1][1]:
+                self.done[-1] = (self.done[-1][0], max(self.done[-1][1], range_stop))
+            else:
+                self.done.append((range_start, range_stop))
+        self.write_manifest()
+
+    def close(self):
+        """Unmaps the result arrays. Everything marked done is on disk."""
+        self.arrays = []
+
+    def remove(self):
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def exists(key, root=DEFAULT_CHECKPOINT_DIR):
+    return os.path.exists(os.path.join(root, key, "manifest.json"))
+
+
+def prune(root=DEFAULT_CHECKPOINT_DIR, max_age_seconds=MAX_AGE_SECONDS):
+    """Removes checkpoints that haven't been written to for max_age_seconds"""
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return
+    now = time.time()
+    for entry in entries:
+        try:
+            if now - entry.stat().st_mtime > max_age_seconds:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def keyframe_chunks(index, start, stop, size):
+    """Splits frames start to stop - 1 of a VideoIndex into chunks of about
+    size frames that start on keyframes. Returns [start, stop) pairs."""
+    keyframe_nums = np.unique(np.searchsorted(index.pts, index.keyframes))
+    bounds = [start]
+    while stop - bounds[-1] > size:
+        i = np.searchsorted(keyframe_nums, bounds[-1] + size)
+        if i >= len(keyframe_nums) or keyframe_nums[i] >= stop:
+            break
+        bounds.append(int(keyframe_nums[i]))
+    bounds.append(stop)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def process_resumable(
+    key, files, lines, rotation, direction, interpolation="bilinear",
+    disk_backed=False, is_cancelled=None, on_progress=None, workers=None,
+    backend="auto", start_seconds=None, end_seconds=None, roi=None, downscale=1,
+    cache=None, root=DEFAULT_CHECKPOINT_DIR,
+):
+    """Like process_video, or process_files given several files, but keeps a
+    checkpoint under key, the result's cache key, as it goes. Frames done by
+    an earlier run that was interrupted are not processed again.
+
+    The result arrays of a checkpointed run are already on disk, so they are
+    never copied. Once finished they are moved into the ResultCache cache,
+    if given and they fit, and otherwise stay in the checkpoint, which then
+    opens instantly until it is pruned. That includes when they can't be
+    moved, e.g. because the cache is on another drive, in which case
+    cache.has(key) is still False and the caller can copy them in with
+    cache.put(). Either way they come back memory-mapped read only, and
+    disk_backed makes no difference. Runs too short to be worth
+    checkpointing are processed as usual, and not cached.
+
+    Returns a ProcessedVideo, or None if cancelled, in which case the
+    checkpoint is kept for the next run. Its stats only count the frames
+    processed by this run."""
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    stats = ProcessingStats()
+    prune(root)
+
+    with stats.time("index"):
+        if len(files) == 1:
+            indexes = [VideoIndex(files[0], start_seconds, end_seconds)]
+        else:
+            indexes = [VideoIndex(file) for file in files]
+    sizes = {(index.frame_width, index.frame_height) for index in indexes}
+    if len(sizes) > 1:
+        raise ValueError("The videos must all have the same frame size")
+    frame_width, frame_height = sizes.pop()
+    stitched = StitchedIndex(files, indexes)
+    num_frames = stitched.num_frames
+
+    samplers = make_samplers(
+        frame_width,
+        frame_height,
+        lines,
+        rotation,
+        interpolation=interpolation,
+        roi=roi,
+        downscale=downscale,
+    )
+    if backend == "auto":
+        container = av.open(files[0])
+        try:
+            backend = choose_backend(
+                container, samplers, workers, start_seconds, end_seconds
+            )
+        finally:
+            container.close()
+    chunk_frames = CHECKPOINT_FRAMES * (workers if backend == "process" else 1)
+
+    if num_frames < MIN_CHECKPOINT_CHUNKS * chunk_frames and not exists(key, root):
+        options = dict(
+            interpolation=interpolation,
+            disk_backed=disk_backed,
+            is_cancelled=is_cancelled,
+            on_progress=on_progress,
+            workers=workers,
+            backend=backend,
+            roi=roi,
+            downscale=downscale,
+        )
+        if len(files) > 1:
+            return process_files(files, lines, rotation, direction, **options)
+        return process_video(
+            files[0],
+            lines,
+            rotation,
+            direction,
+            start_seconds=start_seconds,
+            end_seconds=end_seconds,
+            **options,
+        )
+
+    checkpoint = Checkpoint(
+        key, [(sampler.height, num_frames, 3) for sampler in samplers], root
+    )
+    done_before = checkpoint.frames_done()
+    frames_done = 0
+    backends = []
+    for range_start, range_stop in checkpoint.remaining(num_frames):
+        while range_start < range_stop:
+            # Chunks never cross from one file into the next
+            i, file_start = stitched.locate(range_start)
+            offset = int(stitched.offsets[i])
+            if file_start >= indexes[i].num_frames:
+                # A gap between files stays blank
+                gap_stop = min(int(stitched.offsets[i + 1]), range_stop)
+                checkpoint.mark_done(range_start, gap_stop)
+                range_start = gap_stop
+                continue
+            file_stop = min(range_stop - offset, indexes[i].num_frames)
+            for chunk_start, chunk_stop in keyframe_chunks(
+                indexes[i], file_start, file_stop, chunk_frames
+            ):
+                first, last = offset + chunk_start, offset + chunk_stop
+                if direction > 0:
+                    # The result runs right to left
+                    left, right = num_frames - last, num_frames - first
+                else:
+                    left, right = first, last
+
+                def chunk_progress(done, total, first_done=done_before + frames_done):
+                    if on_progress:
+                        on_progress(first_done + done, num_frames)
+
+                chunk_frames_done, chunk_backend = extract_file(
+                    files[i],
+                    indexes[i].subset(chunk_start, chunk_stop),
+                    samplers,
+                    [array[:, left:right] for array in checkpoint.arrays],
+                    direction,
+                    backend=backend,
+                    is_cancelled=is_cancelled,
+                    on_progress=chunk_progress,
+                    workers=workers,
+                    stats=stats,
+                )
+                if chunk_frames_done is None:
+                    return None
+                frames_done += chunk_frames_done
+                if chunk_backend not in backends:
+                    backends.append(chunk_backend)
+                with stats.time("checkpoint"):
+                    checkpoint.mark_done(first, last)
+            range_start = offset + file_stop
+
+    checkpoint.close()
+
+    stats.backend = ",".join(backends) or backend
+    stats.frames = frames_done
+    stats.wall_seconds = time.perf_counter() - start
+    if len(files) == 1:
+        first_frame, index = indexes[0].first_frame, indexes[0]
+    else:
+        first_frame, index = 0, stitched
+    processed = ProcessedVideo([], first_frame, stats, index)
+
+    if cache is not None:
+        try:
+            adopted = cache.adopt(key, checkpoint.paths, processed)
+        except OSError:
+            adopted = False
+        if adopted:
+            checkpoint.remove()
+            return cache.get(key)
+    processed.result_arrays = [np.load(path, mmap_mode="r") for path in checkpoint.paths]
+    return processed
@@ -0,0 +1,81 @@
+"""Finds the columns of a result where something crosses the finish line.
+
+The finish line sees the same background in every frame until somebody
+crosses it, so every column is compared with an estimate of the background
+along the line. Runs of columns that differ from it are crossing candidates.
+Everything is vectorized over blocks of columns, which keeps it fast and
+memory use flat for very long, memory-mapped results."""
+import numpy as np
+
+
+# Columns handled at a time, and also the span over which the background is
+# assumed not to change, so that slow lighting changes are followed
+BLOCK_COLUMNS = 4096
+
+# Columns sampled from each block to estimate its background
+BACKGROUND_SAMPLES = 256
+
+# Rows sampled from each column. Crossings are far taller than a few rows.
+SAMPLE_ROWS = 128
+
+# How many robust standard deviations above the typical column a column must
+# be to count as a crossing
+SENSITIVITY = 6
+
+# Columns must also differ from the background by at least this much, on
+# average per pixel and channel, so noise in an empty result isn't a crossing
+MIN_DIFFERENCE = 6
+
+# Runs closer together than this are one crossing, runs narrower than this
+# are noise. In columns.
+MIN_GAP = 3
+MIN_WIDTH = 2
+
+
+def column_difference(array):
+    """Returns the mean absolute difference, per pixel and channel, between
+    every column of a (height, width, 3) result and its background"""
+    height, width = array.shape[:2]
+    row_step = max(height // SAMPLE_ROWS, 1)
+    difference = np.empty(width, dtype=np.float32)
+    for start in range(0, width, BLOCK_COLUMNS):
+        block = np.asarray(array[::row_step, start:start + BLOCK_COLUMNS])
+        column_step = max(block.shape[1] // BACKGROUND_SAMPLES, 1)
+        background = np.median(block[:, ::column_step], axis=1).astype(np.int16)
+        block = block.astype(np.int16)
+        block -= background[:, np.newaxis]
+        np.abs(block, out=block)
+        # Summing down the rows of a flattened block is much faster than
+        # mean(axis=(0, 2))
+        total = block.reshape(block.shape[0], -1).sum(axis=0, dtype=np.int32)
+        difference[start:start + block.shape[1]] = (
+            total.reshape(-1, 3).sum(axis=1) / (block.shape[0] * 3)
+        )
+    return difference
+
+
+def find_runs(active):
+    """Returns the [start, end) columns of runs of True in a boolean array"""
+    edges = np.diff(np.concatenate([[False], active, [False]]).astype(np.int8))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def find_crossings(array, sensitivity=SENSITIVITY):
+    """Returns an (n, 2) array of the [start, end) columns of every likely
+    crossing in a result, left to right"""
+    difference = column_difference(array)
+    if not len(difference):
+        return np.empty((0, 2), dtype=np.int64)
+
+    median = np.median(difference)
+    spread = 1.4826 * np.median(np.abs(difference - median))
+    threshold = max(median + sensitivity * spread, MIN_DIFFERENCE)
+    starts, ends = find_runs(difference > threshold)
+
+    # Join runs separated by small gaps, then drop runs that are too narrow
+    if len(starts):
+        joined = np.flatnonzero(starts[1:] - ends[:-1] > MIN_GAP)
+        starts = np.concatenate([starts[:1], starts[joined + 1]])
+        ends = np.concatenate([ends[joined], ends[-1:]])
+    wide = ends - starts >= MIN_WIDTH
+    return np.stack([starts[wide], ends[wide]], axis=1)
@@ -0,0 +1,216 @@
+"""Writes result images to disk a strip at a time, straight from the result
+array, so that exporting a result that is hundreds of thousands of pixels
+wide needs neither a copy of it in PIL nor much memory."""
+import os
+import struct
+import zlib
+
+import numpy as np
+
+
+# Default zlib compression level. 1 is several times faster than PIL's
+# default of 6 and the files are only slightly bigger.
+DEFAULT_COMPRESS_LEVEL = 1
+
+# Rows encoded at a time when writing a PNG
+STRIP_ROWS = 16
+
+# Width and height of TIFF tiles. Must be a multiple of 16.
+TILE_SIZE = 256
+
+FORMATS = ["png", "tiff"]
+
+
+def png_chunk(out_file, chunk_type, data):
+    out_file.write(struct.pack(">I", len(data)))
+    out_file.write(chunk_type)
+    out_file.write(data)
+    out_file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+def write_png(
+    array, path, compress_level=DEFAULT_COMPRESS_LEVEL, on_progress=None,
+    is_cancelled=None,
+):
+    """Writes a (height, width, 3) uint8 array as an RGB PNG. Every row is
+    stored with PNG's Up filter, which suits results because neighbouring rows
+    of a column come from the same frame. Returns False if cancelled."""
+    height, width = array.shape[:2]
+    compressor = zlib.compressobj(compress_level)
+    with open(path, "wb") as out_file:
+        out_file.write(b"\x89PNG\r\n\x1a\n")
+        png_chunk(
+            out_file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+        )
+        previous = np.zeros((1, width, 3), dtype=np.uint8)
+        for start in range(0, height, STRIP_ROWS):
+            if is_cancelled and is_cancelled():
+                return False
+            strip = np.asarray(array[start:start + STRIP_ROWS])
+            # Up filter, each row minus the one above it, wrapping around
+            rows = np.empty((len(strip), 1 + width * 3), dtype=np.uint8)
+            rows[:, 0] = 2
+            np.subtract(
+                strip,
+                np.concatenate([previous, strip[:-1]]),
+                out=rows[:, 1:].reshape(len(strip), width, 3),
+            )
+            previous = strip[-1:]
+            data = compressor.compress(rows.tobytes())
+            if data:
+                png_chunk(out_file, b"IDAT", data)
+            if on_progress:
+                on_progress(start + len(strip), height)
+        png_chunk(out_file, b"IDAT", compressor.flush())
+        png_chunk(out_file, b"IEND", b"")
+    return True
+
+
+def write_tiff(
+    array, path, compress_level=DEFAULT_COMPRESS_LEVEL, on_progress=None,
+    is_cancelled=None,
+):
+    """Writes a (height, width, 3) uint8 array as a tiled RGB TIFF, deflate
+    compressed unless compress_level is 0. Viewers that understand tiles only
+    read the tiles they show. Tiles are written as they are encoded and the
+    directory goes at the end, so the image is never held in memory. A
+    BigTIFF is written if the file could pass 4 GiB. Returns False if
+    cancelled."""
+    height, width = array.shape[:2]
+    tiles_across = -(-width // TILE_SIZE)
+    tiles_down = -(-height // TILE_SIZE)
+    big = tiles_across * tiles_down * TILE_SIZE**2 * 3 > 2**32 - 2**24
+    offset_format = "<Q" if big else "<I"
+
+    offsets = []
+    byte_counts = []
+    with open(path, "wb") as out_file:
+        if big:
+            out_file.write(b"II" + struct.pack("<HHHQ", 43, 8, 0, 0))
+        else:
+            out_file.write(b"II" + struct.pack("<HI", 42, 0))
+
+        tile = np.zeros((TILE_SIZE, TILE_SIZE, 3), dtype=np.uint8)
+        for tile_row in range(tiles_down):
+            if is_cancelled and is_cancelled():
+                return False
+            top = tile_row * TILE_SIZE
+            strip = np.asarray(array[top:top + TILE_SIZE])
+            for tile_column in range(tiles_across):
+                left = tile_column * TILE_SIZE
+                part = strip[:, left:left + TILE_SIZE]
+                if part.shape[:2] != tile.shape[:2]:
+                    # Edge tiles are padded out to the full tile size
+                    tile[:] = 0
+                    tile[:part.shape[0], :part.shape[1]] = part
+                    part = tile
+                data = part.tobytes()
+                if compress_level:
+                    data = zlib.compress(data, compress_level)
+                offsets.append(out_file.tell())
+                byte_counts.append(len(data))
+                out_file.write(data)
+            if on_progress:
+                on_progress(min(top + TILE_SIZE, height), height)
+
+        # Word align the arrays and the directory
+        if out_file.tell() % 2:
+            out_file.write(b"\0")
+        offset_type = 16 if big else 4  # LONG8 or LONG
+        offsets_at = out_file.tell()
+        out_file.write(
+            np.array(offsets, dtype="<u8" if big else "<u4").tobytes()
+        )
+        byte_counts_at = out_file.tell()
+        out_file.write(
+            np.array(byte_counts, dtype="<u8" if big else "<u4").tobytes()
+        )
+        bits_at = out_file.tell()
+        out_file.write(struct.pack("<HHH", 8, 8, 8))
+
+        num_tiles = len(offsets)
+        # (tag, type, count, value), in tag order. Type 3 is SHORT, 4 LONG.
+        entries = [
+            (256, 4, 1, width),  # ImageWidth
+            (257, 4, 1, height),  # ImageLength
+            (258, 3, 3, bits_at),  # BitsPerSample
+            (259, 3, 1, 8 if compress_level else 1),  # Compression
+            (262, 3, 1, 2),  # PhotometricInterpretation, RGB
+            (277, 3, 1, 3),  # SamplesPerPixel
+            (284, 3, 1, 1),  # PlanarConfiguration, chunky
+            (322, 3, 1, TILE_SIZE),  # TileWidth
+            (323, 3, 1, TILE_SIZE),  # TileLength
+            (324, offset_type, num_tiles, offsets_at),  # TileOffsets
+            (325, offset_type, num_tiles, byte_counts_at),  # TileByteCounts
+        ]
+        if num_tiles == 1:
+            # A single value is stored in the entry itself
+            entries[-2] = (324, offset_type, 1, offsets[0])
+            entries[-1] = (325, offset_type, 1, byte_counts[0])
+
+        directory_at = out_file.tell()
+        if big:
+            out_file.write(struct.pack("<Q", len(entries)))
+            for tag, value_type, count, value in entries:
+                if tag == 258:
+                    # Three SHORTs fit in a BigTIFF entry, so they go inline
+                    value = struct.pack("<HHH", 8, 8, 8).ljust(8, b"\0")
+                elif value_type == 3 and count == 1:
+                    value = struct.pack("<H", value).ljust(8, b"\0")
+                else:
+                    value = struct.pack("<Q", value)
+                out_file.write(struct.pack("<HHQ", tag, value_type, count) + value)
+            out_file.write(struct.pack("<Q", 0))
+            out_file.seek(8)
+        else:
+            out_file.write(struct.pack("<H", len(entries)))
+            for tag, value_type, count, value in entries:
+                if value_type == 3 and count == 1:
+                    value = struct.pack("<H", value).ljust(4, b"\0")
+                else:
+                    value = struct.pack("<I", value)
+                out_file.write(struct.pack("<HHI", tag, value_type, count) + value)
+            out_file.write(struct.pack("<I", 0))
+            out_file.seek(4)
+        out_file.write(struct.pack(offset_format, directory_at))
+    return True
+
+
+def part_paths(path, parts):
+    """Returns the file names of an export split into parts"""
+    if parts <= 1:
+        return [path]
+    name, extension = os.path.splitext(path)
+    return [f"{name}-{i + 1}of{parts}{extension}" for i in range(parts)]
+
+
+def export(
+    array, path, format="png", compress_level=DEFAULT_COMPRESS_LEVEL, parts=1,
+    on_progress=None, is_cancelled=None,
+):
+    """Writes a result as a PNG or tiled TIFF, optionally split into parts of
+    equal width from left to right. on_progress is called with the number of
+    rows written and the total across all parts. Returns the paths written,
+    or None if cancelled."""
+    write = {"png": write_png, "tiff": write_tiff}[format]
+    height, width = array.shape[:2]
+    parts = max(1, min(parts, width))
+    bounds = np.linspace(0, width, parts + 1).round().astype(int)
+    paths = part_paths(path, parts)
+    for i, part_path in enumerate(paths):
+
+        def part_progress(rows, total, i=i):
+            if on_progress:
+                on_progress(i * height + rows, parts * height)
+
+        finished = write(
+            array[:, bounds[i]:bounds[i + 1]],
+            part_path,
+            compress_level,
+            on_progress=part_progress,
+            is_cancelled=is_cancelled,
+        )
+        if not finished:
+            os.remove(part_path)
+            return None
+    return paths
@@ -0,0 +1,107 @@
+"""Runs long jobs, like processing a video, off the UI thread.
+
+The worker and the UI only ever talk through a Job. The worker reports
+progress, which just records the latest value, and checks whether it has
+been cancelled. The UI thread calls poll() at its own fixed rate, which
+hands it the progress, frame rate and time left, and the job's outcome once
+it is done. No UI code ever runs on the worker thread, and however fast the
+worker reports progress the UI only redraws at its own rate."""
+from collections import deque
+import queue
+from threading import Event, Thread
+import time
+
+
+# Progress over this many seconds gives the current rate
+RATE_WINDOW_SECONDS = 3
+
+
+class Job:
+    """Runs target(job) on its own thread.
+
+    on_progress(done, total, rate, seconds_left), on_finished(result) and
+    on_failed(exception) are called from poll(), on the thread that polls.
+    rate and seconds_left are None until they can be estimated. A cancelled
+    job still finishes, with whatever target returns once it has stopped."""
+
+    def __init__(self, target, on_progress=None, on_finished=None, on_failed=None):
+        self.target = target
+        self.on_progress = on_progress
+        self.on_finished = on_finished
+        self.on_failed = on_failed
+        self.events = queue.Queue()
+        self.cancelled = Event()
+        # Latest (done, total) reported by the worker. Replacing a tuple is
+        # atomic, so no lock is needed.
+        self.latest = None
+        self.shown = None
+        self.samples = deque()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.started = time.monotonic()
+        Thread(target=self.run, daemon=True).start()
+        return self
+
+    def run(self):
+        try:
+            result = self.target(self)
+        except Exception as e:
+            self.events.put(("failed", e))
+        else:
+            self.events.put(("finished", result))
+
+    # Called by the worker
+
+    def progress(self, done, total):
+        self.latest = (done, total)
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+    # Called by the UI
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def rate(self, done):
+        """Returns progress per second over the last few seconds"""
+        now = time.monotonic()
+        self.samples.append((now, done))
+        while len(self.samples) > 2 and now - self.samples[0][0] > RATE_WINDOW_SECONDS:
+            self.samples.popleft()
+        then, done_then = self.samples[0]
+        if now - then < 0.1:
+            return None
+        return (done - done_then) / (now - then)
+
+    def poll(self):
+        """Passes on progress and the outcome of the job. Returns True while
+        the job is still running."""
+        latest = self.latest
+        if latest is not None and latest != self.shown and self.on_progress:
+            self.shown = latest
+            done, total = latest
+            rate = self.rate(done)
+            seconds_left = None
+            if rate:
+                seconds_left = max(total - done, 0) / rate
+            self.on_progress(done, total, rate, seconds_left)
+
+        try:
+            event, value = self.events.get_nowait()
+        except queue.Empty:
+            return True
+        self.running = False
+        if event == "finished" and self.on_finished:
+            self.on_finished(value)
+        elif event == "failed" and self.on_failed:
+            self.on_failed(value)
+        return False
+
+
+def format_seconds(seconds):
+    """Formats a duration as m:ss"""
+    seconds = int(round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
@@ -0,0 +1,202 @@
+"""Live mode. Builds results while the video is still being recorded, either by
+following a file that is still growing or by reading a local capture device.
+
+Only formats that can be read before they are finished work for growing
+files: MPEG-TS, Matroska, or fragmented MP4. A plain MP4 has its index
+written at the very end and can't be followed."""
+import tempfile
+import time
+
+import av
+import numpy as np
+
+from processing import ProcessingStats, make_samplers, sample_lines
+
+
+# Prefixes that mark a source as a capture device, e.g. "v4l2:/dev/video0" or
+# "dshow:video=USB Camera"
+CAPTURE_FORMATS = ["v4l2", "dshow", "avfoundation", "x11grab", "gdigrab"]
+
+# How long to wait for a growing file to get longer before checking again
+FOLLOW_POLL_SECONDS = 0.1
+
+# Demuxer options for following a file close behind the recorder
+LOW_LATENCY_OPTIONS = {"probesize": "65536", "analyzeduration": "0"}
+
+# nobuffer also throws away the packets read while the stream is probed. A
+# capture device only loses a moment of its picture to that, but a file
+# would lose its first frames.
+CAPTURE_OPTIONS = {**LOW_LATENCY_OPTIONS, "fflags": "nobuffer"}
+
+# Columns added to a live result's backing file each time it fills up
+GROW_COLUMNS = 4096
+
+
+def is_capture_device(source):
+    return source.split(":", 1)[0] in CAPTURE_FORMATS
+
+
+class FollowFile:
+    """A read only file object that waits for more data at the end of the
+    file instead of reporting end of file, like tail -f. Reading stops once
+    is_cancelled returns True, or once the file hasn't grown for
+    idle_seconds."""
+
+    def __init__(self, path, is_cancelled=None, idle_seconds=None):
+        self.file = open(path, "rb")
+        self.is_cancelled = is_cancelled
+        self.idle_seconds = idle_seconds
+
+    def read(self, size=-1):
+        idle_since = time.monotonic()
+        while True:
+            data = self.file.read(size)
+            if data:
+                return data
+            if self.is_cancelled and self.is_cancelled():
+                return b""
+            if (
+                self.idle_seconds is not None
+                and time.monotonic() - idle_since > self.idle_seconds
+            ):
+                return b""
+            time.sleep(FOLLOW_POLL_SECONDS)
+
+    def close(self):
+        self.file.close()
+
+
+def open_source(source):
+    """Opens a video file, or a capture device given as format:device"""
+    if is_capture_device(source):
+        format, device = source.split(":", 1)
+        return av.open(device, format=format, options=CAPTURE_OPTIONS)
+    return av.open(source)
+
+
+class GrowingResult:
+    """A result that columns are appended to as they arrive.
+
+    Columns are stored frame by frame in a memory-mapped temporary file, so
+    appending never moves what is already there and memory use stays flat
+    however long the session runs. view() returns the usual (height, width,
+    3) result array as a view of the file."""
+
+    def __init__(self, height, direction):
+        self.height = height
+        self.direction = direction
+        self.file = tempfile.TemporaryFile(prefix="finishline-live-")
+        self.capacity = 0
+        self.length = 0
+        self.storage = None
+        self.grow()
+
+    def grow(self):
+        self.capacity += GROW_COLUMNS
+        self.file.truncate(self.capacity * self.height * 3)
+        self.storage = np.memmap(
+            self.file, dtype=np.uint8, mode="r+", shape=(self.capacity, self.height, 3)
+        )
+
+    def append(self, column):
+        if self.length == self.capacity:
+            self.grow()
+        self.storage[self.length] = column
+        self.length += 1
+
+    def view(self):
+        """Returns the result so far. Like every other result, it runs right
+        to left when the direction of travel is left to right."""
+        array = self.storage[:self.length].swapaxes(0, 1)
+        if self.direction > 0:
+            array = array[:, ::-1]
+        return array
+
+
+class LiveExtractor:
+    """Samples finish lines from a live source into GrowingResults.
+
+    run() blocks until the source ends or is_cancelled returns True, so it
+    is meant to be run on its own thread. The results can be read from other
+    threads while it runs."""
+
+    def __init__(
+        self, source, lines, rotation, direction, interpolation="bilinear",
+        is_cancelled=None, idle_seconds=None, roi=None, downscale=1,
+    ):
+        self.source = source
+        self.lines = lines
+        self.rotation = rotation
+        self.direction = direction
+        self.interpolation = interpolation
+        self.is_cancelled = is_cancelled
+        self.idle_seconds = idle_seconds
+        self.roi = roi
+        self.downscale = downscale
+        self.results = []
+        self.fps = None
+        # Frame number, within the whole stream, of the first column. The
+        # recording may have started before it could be read.
+        self.first_frame = 0
+        self.stats = ProcessingStats()
+        self.stats.backend = "inline"
+        self.stats.workers = 1
+
+    @property
+    def frames(self):
+        return self.results[0].length if self.results else 0
+
+    def run(self):
+        start = time.perf_counter()
+        if is_capture_device(self.source):
+            container = open_source(self.source)
+        else:
+            container = av.open(
+                FollowFile(
+                    self.source,
+                    is_cancelled=self.is_cancelled,
+                    idle_seconds=self.idle_seconds,
+                ),
+                mode="r",
+                # Start as soon as the stream can be identified, rather than
+                # reading ahead for seconds of video first
+                options=LOW_LATENCY_OPTIONS,
+            )
+        try:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            self.fps = float(stream.average_rate or stream.base_rate or 30)
+            samplers = make_samplers(
+                stream.codec_context.width,
+                stream.codec_context.height,
+                self.lines,
+                self.rotation,
+                interpolation=self.interpolation,
+                roi=self.roi,
+                downscale=self.downscale,
+            )
+            results = [
+                GrowingResult(sampler.height, self.direction) for sampler in samplers
+            ]
+            for frame in container.decode(stream):
+                if self.is_cancelled and self.is_cancelled():
+                    break
+                if not self.results and frame.pts is not None:
+                    self.first_frame = round(
+                        float((frame.pts - (stream.start_time or 0)) * stream.time_base)
+                        * self.fps
+                    )
+                with self.stats.time("assemble"):
+                    for result, line in zip(
+                        results, sample_lines(frame, samplers, self.stats)
+                    ):
+                        result.append(line)
+                # Only publish the results once they have a column to show
+                self.results = results
+                self.stats.frames += 1
+        finally:
+            container.close()
+            self.stats.wall_seconds = time.perf_counter() - start
+            self.stats.busy_seconds = sum(
+                seconds for seconds, _ in self.stats.stages.values()
+            )
@@ -1,77 +1,127 @@
 from datetime import datetime
 import math
+from multiprocessing import freeze_support
+import sys
+
+if __name__ == "__main__" and sys.argv[1:2] == ["batch"]:
+    # Batch mode never builds a window, so it is started before anything
+    # that needs Tk is imported, and runs where Tk isn't installed
+    freeze_support()
+    import batch
+    sys.exit(batch.main(sys.argv[2:]))
+
 import tkinter as tk
-from tkinter import ttk, filedialog
-from PIL import Image, ImageTk
-import av
+from tkinter import ttk, filedialog, simpledialog
+from PIL import ImageTk
 from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta
-from threading import Thread
-import time
-from multiprocessing import Pool, freeze_support
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
+from bibtimes import COMPACT_SECONDS, DEFAULT_BIB_TIMES_FILENAME, BibTimes, CompactionError
+from cache import ResultCache
+from checkpoint import process_resumable
+from crossings import find_crossings
+from export import DEFAULT_COMPRESS_LEVEL, FORMATS, export
+from jobs import Job, format_seconds
+from live import CAPTURE_FORMATS, LiveExtractor, is_capture_device, open_source
+from preview import KeyframeScrubber
+from processing import (
+    FrameSource, StitchedFrameSource, StitchedIndex, VideoInfo,
+    allocate_result_array, parse_seconds, process_files, process_video,
+)
+from store import ResultStore
+from viewer import TiledViewer
 
-DEFAULT_BIB_TIMES_FILENAME = "bib_times.csv"
 
+CSV_NOT_UPDATED = (
+    "The time was saved, but the csv couldn't be updated. Most likely because "
+    "it is open in another window. Close it, and it will be updated with the "
+    "next number."
+)
 
-class BibTimes:
-    def __init__(self):
-        self.bib_times = []
-        self.bib_results_filename = DEFAULT_BIB_TIMES_FILENAME
+# Largest size the source frame is shown at, in screen pixels
+FRAME_VIEW_SIZE = (960, 720)
 
-    def add(self, bib_time):
-        self.bib_times.append(bib_time)
-        self.bib_times = sorted(self.bib_times, key=lambda bib_time: bib_time[1])
-        try:
-            filename, extension = self.bib_results_filename.split(".")
-        except Exception:
-            filename = self.bib_results_filename
-            extension = "csv"
+# How often the preview scrubber is extended while keyframes are decoded
+SCRUBBER_REFRESH_MS = 200
+
+# How often live results are redrawn while they grow, in milliseconds
+LIVE_REFRESH_MS = 250
+
+# How often the progress of a running job is shown, in milliseconds
+UI_REFRESH_MS = 100
 
-        with open(f"{filename}.csv", "w") as out_file:
-            for bib_time in self.bib_times:
-                out_file.write(f"{bib_time[0]}, {bib_time[1]}\n")
+
+def run_job(widget, job):
+    """Starts a job and polls it from the Tk thread every UI_REFRESH_MS
+    until it is done. Returns the job."""
+
+    def poll():
+        if job.poll():
+            widget.after(UI_REFRESH_MS, poll)
+
+    job.start()
+    poll()
+    return job
+
+
+def show_error(error):
+    """Pops up a window with an error message"""
+    popup = tk.Tk()
+    popup.wm_title("!")
+    label = ttk.Label(popup, text=error)
+    label.pack(side="top", fill="x", pady=10)
+    B1 = ttk.Button(popup, text="Okay", command = popup.destroy)
+    B1.pack()
+    popup.mainloop()
 
 
 class Result:
     def __init__(
-            self, tab_control, out, direction, start_time, fps, bib_times
+            self, tab_control, result_array, direction, start_time, fps, bib_times,
+            label=None, stats=None, frame_source=None,
         ):
         self.tab = ttk.Frame(tab_control)
+        # Tells tabs from the same video apart when several lines were extracted
+        self.label = label
+        # ProcessingStats of the run that made this result
+        self.stats = stats
+        # FrameSource of the frames behind the columns, if they can be looked
+        # up
+        self.frame_source = frame_source
+        self.frame_window = None
+        # Frame lookups run on their own thread, newest request only
+        self.frame_requests = ThreadPoolExecutor(max_workers=1)
+        self.requested_frame = None
         self.tab_control = tab_control
         self.tab_control.add(self.tab, text=f'{start_time.strftime(".   %H:%M:%S   .")}')
-        self.result_canvas = None
         self.result_canvas_frame = ttk.Frame(self.tab)
         self.result_canvas_frame.pack(expand=True, fill=tk.BOTH)
         self.fps = fps
         self.start_time = start_time
         self.direction = direction
         self.bib_times = bib_times
+
+        # The (height, width, 3) uint8 result. This may be a numpy.memmap for
+        # very long videos, so it is kept as is rather than copied into PIL.
+        self.result_array = result_array
+        self.height, self.width = result_array.shape[:2]
+        # Set when the pixels have been moved out of RAM by the ResultStore
+        self.evicted = False
+        # Whether the pixels are being moved to disk in the background
+        self.spilling = False
         if direction > 0:
-            from_ = out.width
+            from_ = self.width
             to = 0
         else:
             from_ = 0
-            to = out.width
+            to = self.width
 
-        self.result_canvas = tk.Canvas(
-            self.result_canvas_frame, scrollregion=(0, 0, out.width, out.height)
-        )
-        self.result_hbar = ttk.Scrollbar(
-            self.result_canvas_frame, orient=tk.HORIZONTAL
-        )
-        self.result_hbar.pack(side=tk.BOTTOM, fill=tk.X)
-        self.result_hbar.config(command=self.result_canvas.xview)
-
-        self.result_vbar = ttk.Scrollbar(
-            self.result_canvas_frame, orient=tk.VERTICAL
-        )
-        self.result_vbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.result_vbar.config(command=self.result_canvas.yview)
-
-        self.result_canvas.config(
-            xscrollcommand=self.result_hbar.set, yscrollcommand=self.result_vbar.set
+        # Only the visible part of the result is drawn, so very wide results
+        # open instantly
+        self.viewer = TiledViewer(
+            self.result_canvas_frame, result_array, on_click=self.move_cursor_to
         )
 
         self.slider = tk.Scale(
@@ -79,10 +129,9 @@ class Result:
             from_=from_,
             to=to,
             orient=tk.HORIZONTAL,
-            length=out.width,
             command=self.update_cursor,
         )
-        self.slider.pack(side=tk.TOP, anchor=tk.NW)
+        self.slider.pack(side=tk.TOP, fill=tk.X)
 
         self.stats_frame = ttk.Frame(self.tab)
         self.stats_frame.pack()
@@ -90,19 +139,29 @@ class Result:
         self.save_btn = ttk.Button(self.stats_frame, text="Save", command=self.save)
         self.save_btn.grid(row=3, column=0)
 
-        self.tk_image_result = ImageTk.PhotoImage(out)
-        self.out_image = out
-
-        self.result = self.result_canvas.create_image(
-            0, 0, anchor=tk.NW, image=self.tk_image_result
+        self.zoom_in_btn = ttk.Button(
+            self.stats_frame, text="Zoom In", command=lambda: self.viewer.zoom(1)
         )
-        if direction > 0:
-            x = out.width - self.slider.get()
-        else:
-            x = self.slider.get()
+        self.zoom_in_btn.grid(row=3, column=1)
+        self.zoom_out_btn = ttk.Button(
+            self.stats_frame, text="Zoom Out", command=lambda: self.viewer.zoom(-1)
+        )
+        self.zoom_out_btn.grid(row=3, column=2)
 
-        self.cursor = self.result_canvas.create_line(x, 0, x, out.height, width=1, fill="#ffffff")
-        self.result_canvas.pack(expand=True, fill=tk.BOTH)
+        if frame_source:
+            self.frame_btn = ttk.Button(
+                self.stats_frame, text="Show Frame", command=self.toggle_frame
+            )
+            self.frame_btn.grid(row=3, column=6)
+
+        if stats:
+            self.stats_btn = ttk.Button(
+                self.stats_frame, text="Processing Stats", command=self.toggle_stats
+            )
+            self.stats_btn.grid(row=3, column=3)
+            self.stats_label = ttk.Label(self.stats_frame, text=stats.format())
+
+        self.viewer.pack(expand=True, fill=tk.BOTH)
 
         self.start_label = ttk.Label(
             self.stats_frame, text=f"Start Time: "
@@ -145,17 +204,52 @@ class Result:
         )
         self.update_btn.grid(row=2, column=1)
 
+        self.find_btn = ttk.Button(
+            self.stats_frame, text="Find number", command=self.find_number
+        )
+        self.find_btn.grid(row=2, column=3)
+        self.correct_btn = ttk.Button(
+            self.stats_frame, text="Correct number", command=self.correct_number
+        )
+        self.correct_btn.grid(row=2, column=4)
+
         self.resolution_label = ttk.Label(
             self.stats_frame,
         )
         self.resolution_label.grid(row=2, column=0)
+
+        # Slider positions of likely crossings, earliest first. None until
+        # they have been found.
+        self.crossings = None
+        self.previous_btn = ttk.Button(
+            self.stats_frame, text="< Previous finisher", command=self.previous_crossing
+        )
+        self.previous_btn.grid(row=3, column=4)
+        self.next_btn = ttk.Button(
+            self.stats_frame, text="Next finisher >", command=self.next_crossing
+        )
+        self.next_btn.grid(row=3, column=5)
+        self.crossings_label = ttk.Label(self.stats_frame, text="Finding finishers...")
+        self.crossings_label.grid(row=2, column=5)
+        self.start_finding_crossings()
+
         self.update_stats()
 
     def get_name(self):
         resolution = round(1 / self.fps, 6)
-        duration = self.out_image.width * resolution
+        duration = self.width * resolution
         end_time = self.start_time + relativedelta(seconds=duration)
-        return f'{self.start_time.strftime("%H:%M:%S")} - {end_time.strftime("%H:%M:%S")}'
+        name = f'{self.start_time.strftime("%H:%M:%S")} - {end_time.strftime("%H:%M:%S")}'
+        if self.label:
+            name = f"{name} ({self.label})"
+        return name
+
+    def toggle_stats(self):
+        """Shows or hides the processing stats panel"""
+        if self.stats_label.winfo_ismapped():
+            self.stats_label.grid_remove()
+        else:
+            self.stats_label.grid(row=4, column=0, columnspan=5, sticky=tk.W)
 
     def update_stats(self):
         """Updates the result tab's stats based on the inputs from the UI"""
@@ -168,7 +262,7 @@ class Result:
 
     def get_cursor_time(self):
         """returns the time at which the result cursor is located in the result image"""
-        if self.out_image:
+        if self.width:
             seconds_from_start = self.slider.get() / self.fps
             return (
                 self.start_time + relativedelta(seconds=seconds_from_start)
@@ -177,23 +271,277 @@ class Result:
     def update_cursor(self, *args, **kwargs):
         """Updates the location of the cursor on the result tab"""
         if self.direction > 0:
-            x = self.out_image.width - self.slider.get()
+            x = self.width - self.slider.get()
         else:
             x = self.slider.get()
 
-        self.result_canvas.coords(self.cursor, x, 0, x, self.out_image.height)
+        self.viewer.set_cursor(min(x, self.width - 1))
 
         self.cursor_position.config(text=f"{self.get_cursor_time()}")
+        if self.frame_window:
+            self.request_frame(min(x, self.width - 1))
+
+    def toggle_frame(self):
+        """Opens or closes a window showing the video frame at the cursor"""
+        if self.frame_window:
+            self.close_frame()
+            return
+        self.frame_window = tk.Toplevel(self.tab)
+        self.frame_window.title(f"Frame - {self.get_name()}")
+        self.frame_window.protocol("WM_DELETE_WINDOW", self.close_frame)
+        self.frame_label = ttk.Label(self.frame_window)
+        self.frame_label.pack(expand=True, fill=tk.BOTH)
+        self.update_cursor()
+
+    def close_frame(self):
+        self.frame_window.destroy()
+        self.frame_window = None
+
+    def request_frame(self, x):
+        """Looks up the frame behind column x in the background"""
+        if self.direction > 0:
+            frame_num = self.width - x - 1
+        else:
+            frame_num = x
+        self.requested_frame = frame_num
+        self.poll_frame(frame_num, self.frame_requests.submit(self.load_frame, frame_num))
+
+    def load_frame(self, frame_num):
+        """Returns the frame behind a column, or None. Runs on the
+        frame_requests thread, so it must not touch the window."""
+        # Skip requests the cursor has already moved on from
+        if frame_num != self.requested_frame:
+            return None
+        try:
+            return self.frame_source.frame(frame_num)
+        except (OSError, ValueError) as e:
+            print(f"Failed to load frame {frame_num}. {e}")
+            return None
+
+    def poll_frame(self, frame_num, future):
+        """Shows a looked up frame once it is ready. Runs on the Tk thread
+        every UI_REFRESH_MS until then."""
+        if not future.done():
+            self.tab.after(UI_REFRESH_MS, self.poll_frame, frame_num, future)
+            return
+        image = future.result()
+        if image and self.frame_window and frame_num == self.requested_frame:
+            self.frame_image = ImageTk.PhotoImage(image)
+            self.frame_label.config(image=self.frame_image)
+
+    def refresh(self, result_array, final=False):
+        """Shows a live result that has grown since the tab was made. If the
+        cursor was on the newest column it stays on the newest column."""
+        old_width = self.width
+        following = self.slider.get() >= old_width - 1
+        self.result_array = result_array
+        self.height, self.width = result_array.shape[:2]
+        if self.direction > 0:
+            self.slider.config(from_=self.width, to=0)
+        else:
+            self.slider.config(from_=0, to=self.width)
+        # Left to right results grow at the left edge
+        self.viewer.set_array(
+            result_array,
+            build_pyramid=final,
+            added_before=self.width - old_width if self.direction > 0 else 0,
+        )
+        if following:
+            self.slider.set(self.width)
+        self.tab_control.tab(self.tab, text=self.get_name())
+        self.update_cursor()
+        if final:
+            self.start_finding_crossings()
+
+    def start_finding_crossings(self):
+        run_job(
+            self.tab,
+            Job(
+                self.find_crossings,
+                on_finished=lambda found: self.crossings_found(*found),
+            ),
+        )
+
+    def find_crossings(self, job):
+        """Finds likely crossings in the result. Runs on the job's thread."""
+        result_array = self.result_array
+        runs = find_crossings(result_array)
+        width = result_array.shape[1]
+        # A finisher crosses at the edge of the run that is earliest in time
+        if self.direction > 0:
+            positions = width - (runs[:, 1] - 1)
+        else:
+            positions = runs[:, 0]
+        return result_array, np.sort(positions)
+
+    def crossings_found(self, result_array, positions):
+        if result_array.shape != self.result_array.shape:
+            # The result has grown since, e.g. in live mode
+            return
+        self.crossings = positions
+        self.crossings_label.config(text=f"{len(positions)} possible finishers")
+
+    def next_crossing(self):
+        """Moves the cursor to the next likely crossing"""
+        if self.crossings is None:
+            return
+        i = np.searchsorted(self.crossings, self.slider.get(), side="right")
+        if i < len(self.crossings):
+            self.slider.set(int(self.crossings[i]))
+
+    def previous_crossing(self):
+        """Moves the cursor to the previous likely crossing"""
+        if self.crossings is None:
+            return
+        i = np.searchsorted(self.crossings, self.slider.get(), side="left")
+        if i > 0:
+            self.slider.set(int(self.crossings[i - 1]))
+
+    def resident_bytes(self):
+        """Returns the RAM taken by the result's pixels and the frames cached
+        for Show Frame. Memory-mapped pixels can be paged out, so they don't
+        count."""
+        size = self.viewer.pyramid.resident_bytes()
+        if self.frame_source:
+            size += self.frame_source.resident_bytes()
+        if not isinstance(self.result_array, np.memmap):
+            size += self.result_array.nbytes
+        return size
+
+    def evict(self):
+        """Drops the zoom levels and cached frames, and moves the pixels to a
+        memory-mapped temporary file in the background. Returns the number of
+        bytes freed once that is done."""
+        freed = self.resident_bytes()
+        if self.frame_source:
+            self.frame_source.clear()
+        self.viewer.set_array(self.result_array, build_pyramid=False)
+        self.evicted = True
+        if not isinstance(self.result_array, np.memmap) and not self.spilling:
+            self.spilling = True
+            result_array = self.result_array
+
+            def on_failed(e):
+                print(f"Failed to move an idle result to disk. {e}")
+                self.spilling = False
+
+            run_job(
+                self.tab,
+                Job(
+                    lambda job: self.spill(result_array),
+                    on_finished=lambda spilled: self.spilled(result_array, spilled),
+                    on_failed=on_failed,
+                ),
+            )
+        return freed
+
+    def spill(self, result_array):
+        """Returns a copy of the pixels in a memory-mapped temporary file.
+        Runs on the job's thread."""
+        spilled = allocate_result_array(*result_array.shape[:2], disk_backed=True)
+        spilled[:] = result_array
+        # Written out pages can be dropped by the OS without swapping
+        spilled.flush()
+        return spilled
+
+    def spilled(self, result_array, spilled):
+        """Swaps the spilled copy in, unless the result has been looked at
+        or has changed since"""
+        self.spilling = False
+        if self.evicted and self.result_array is result_array:
+            self.result_array = spilled
+            self.viewer.set_array(spilled, build_pyramid=False)
+
+    def reload(self):
+        """Rebuilds the zoom levels of an evicted result in the background.
+        The pixels themselves are paged back in as they are shown."""
+        if self.evicted:
+            self.evicted = False
+            self.viewer.set_array(self.result_array)
+
+    def move_cursor_to(self, x):
+        """Moves the cursor to the given column of the result image"""
+        if self.direction > 0:
+            self.slider.set(self.width - x)
+        else:
+            self.slider.set(x)
 
     def save(self):
-        """Save dialog for saving the result image"""
-        filename = f"Results {self.get_name().replace(':', '-')}"
-        file = filedialog.asksaveasfile(
-            mode="wb", defaultextension=".png", initialfile=filename
+        """Asks how to save the result image"""
+        dialog = tk.Toplevel(self.tab)
+        dialog.title("Save")
+        format = tk.StringVar(value="png")
+        compress_level = tk.IntVar(value=DEFAULT_COMPRESS_LEVEL)
+        parts = tk.IntVar(value=1)
+
+        ttk.Label(dialog, text="Format").grid(row=0, column=0, sticky=tk.W)
+        ttk.Combobox(
+            dialog, textvariable=format, values=FORMATS, state="readonly", width=8
+        ).grid(row=0, column=1, sticky=tk.W)
+        ttk.Label(dialog, text="Compression (0 fastest - 9 smallest)").grid(
+            row=1, column=0, sticky=tk.W
+        )
+        ttk.Spinbox(
+            dialog, from_=0, to=9, textvariable=compress_level, width=8
+        ).grid(row=1, column=1, sticky=tk.W)
+        ttk.Label(dialog, text="Split into images").grid(row=2, column=0, sticky=tk.W)
+        ttk.Spinbox(
+            dialog, from_=1, to=100, textvariable=parts, width=8
+        ).grid(row=2, column=1, sticky=tk.W)
+
+        def save_clicked():
+            try:
+                options = (format.get(), compress_level.get(), parts.get())
+            except tk.TclError:
+                show_error("Compression and number of images must be whole numbers")
+                return
+            dialog.destroy()
+            self.save_as(*options)
+
+        ttk.Button(dialog, text="Save...", command=save_clicked).grid(
+            row=3, column=0, columnspan=2
+        )
+
+    def save_as(self, format, compress_level, parts):
+        """Save dialog for saving the result image. The image is written in
+        the background, so the window stays responsive."""
+        extension = f".{format}"
+        path = filedialog.asksaveasfilename(
+            defaultextension=extension,
+            initialfile=f"Results {self.get_name().replace(':', '-')}{extension}",
+            filetypes=[(format.upper(), f"*{extension}")],
+        )
+        if not path:
+            return
+        self.save_btn.config(state="disabled")
+
+        def on_progress(done, total, rate, seconds_left):
+            self.save_btn.config(text=f"Saving {int(100 * done / total)}%")
+
+        def on_failed(e):
+            show_error(f"Failed to save {path}. {e}")
+            self.save_finished()
+
+        run_job(
+            self.tab,
+            Job(
+                lambda job: export(
+                    self.result_array,
+                    path,
+                    format=format,
+                    compress_level=min(max(compress_level, 0), 9),
+                    parts=parts,
+                    on_progress=job.progress,
+                    is_cancelled=job.is_cancelled,
+                ),
+                on_progress=on_progress,
+                on_finished=lambda paths: self.save_finished(),
+                on_failed=on_failed,
+            ),
         )
-        if file:
-            self.out_image.save(file, "PNG")
-            file.close()
+
+    def save_finished(self):
+        self.save_btn.config(text="Save", state="normal")
 
     def enter_number(self):
         if not self.bib_number.get():
@@ -201,87 +549,155 @@ class Result:
         
         try:
             self.bib_times.add((self.bib_number.get(), self.get_cursor_time()))
+        except CompactionError as e:
+            self.bib_number.delete(0, tk.END)
+            show_error(f"{CSV_NOT_UPDATED} {e}")
         except Exception as e:
-            error = f"Failed to add bib number. Most likely because the csv is open in another window. Close it, and try again. {e}"
-            popup = tk.Tk()
-            popup.wm_title("!")
-            label = ttk.Label(popup, text=error)
-            label.pack(side="top", fill="x", pady=10)
-            B1 = ttk.Button(popup, text="Okay", command = popup.destroy)
-            B1.pack()
-            popup.mainloop()
+            show_error(f"Failed to add bib number. {e}")
         else:
             self.bib_number.delete(0, tk.END)
-        
-
-def sub_process(
-    frame, theta, rotation, line_pos, height, direction, num_frames, frame_num,
-):
-    if rotation or theta:
-        frame = av.VideoFrame.from_ndarray(frame[0], format=frame[1])
-        image = frame.to_image()
-        image = image.rotate(-theta + rotation, expand=True)
 
-        line = image.crop(
-            (line_pos, 0, line_pos + 1, height)
+    def time_to_slider(self, cursor_time):
+        """Returns the slider position of a time given by get_cursor_time, or
+        None if the time isn't in this result"""
+        time_of_day = datetime.strptime(cursor_time, "%H:%M:%S.%f")
+        moment = self.start_time.replace(
+            hour=time_of_day.hour,
+            minute=time_of_day.minute,
+            second=time_of_day.second,
+            microsecond=time_of_day.microsecond,
         )
-        line = np.array(line)
-    else:
-        # If we don't need to rotate, we can save ourselves some effort
-        line = np.ndarray((height, 1, 3))
-        col = frame[0][:, line_pos]
-        line[:, 0, :] = col
+        seconds = (moment - self.start_time).total_seconds()
+        if seconds < 0:
+            # The result runs past midnight
+            seconds += 24 * 60 * 60
+        position = round(seconds * self.fps)
+        if position <= self.width:
+            return position
+
+    def find_number(self):
+        """Moves the cursor to the time entered for a bib number"""
+        bib = self.bib_number.get()
+        if not bib:
+            return
+        for cursor_time in self.bib_times.find(bib):
+            position = self.time_to_slider(cursor_time)
+            if position is not None:
+                self.slider.set(position)
+                return
+        show_error(f"No time in this result has been entered for {bib}")
+
+    def correct_number(self):
+        """Replaces the time entered for a bib number with the cursor time. If
+        the bib has several times, the one closest to the cursor is replaced."""
+        bib = self.bib_number.get()
+        times = self.bib_times.find(bib)
+        if not times:
+            show_error(f"No time has been entered for {bib}")
+            return
 
-    if direction > 0:
-        x = num_frames - frame_num - 1
-    else:
-        x = frame_num
+        def distance(cursor_time):
+            position = self.time_to_slider(cursor_time)
+            if position is None:
+                return math.inf
+            return abs(position - self.slider.get())
 
-    return line, x
+        try:
+            self.bib_times.correct(
+                bib, min(times, key=distance), new_time=self.get_cursor_time()
+            )
+        except CompactionError as e:
+            self.bib_number.delete(0, tk.END)
+            show_error(f"{CSV_NOT_UPDATED} {e}")
+        except Exception as e:
+            show_error(f"Failed to correct bib number. {e}")
+        else:
+            self.bib_number.delete(0, tk.END)
 
-class FinishLine:
-    window = tk.Tk()
-    window.title("Finish Line")
-    tab_control = ttk.Notebook(window)
-    tab_1 = ttk.Frame(tab_control)
-    
-    tab_control.add(tab_1, text="Preview")
-    
-    tab_control.pack(expand=1, fill="both")
 
+class FinishLine:
     canvas = None
     line_pos = 0
     line_pos_rotate = 0
     rotation = 0
 
+    # How the finish line is sampled between pixels when it is tilted.
+    # Either "nearest" or "bilinear".
+    interpolation = "bilinear"
+
     start_time = datetime.now()
     fps = 30
 
-    preview_canvas_frame = ttk.Frame(tab_1)
-    preview_canvas_frame.pack(expand=True, fill=tk.BOTH)
+    # (top, bottom) band of preview rows to extract, or None for all of them
+    roi = None
+
+    # The Job processing a video, or running live mode, if there is one
+    job = None
+
+    def __init__(self):
+        # The window is built here rather than at class definition time so
+        # that importing this module never opens a window.
+        self.window = tk.Tk()
+        self.window.title("Finish Line")
+        self.tab_control = ttk.Notebook(self.window)
+        self.tab_1 = ttk.Frame(self.tab_control)
+
+        self.tab_control.add(self.tab_1, text="Preview")
+
+        self.tab_control.pack(expand=1, fill="both")
+
+        self.preview_canvas_frame = ttk.Frame(self.tab_1)
+        self.preview_canvas_frame.pack(expand=True, fill=tk.BOTH)
+
+        self.results = []
+
+        # For tracking which radio button is selected
+        self.direction = tk.IntVar(value=1)
 
-    results = []
+        # For the progress bar
+        self.progress = tk.IntVar(value=0)
+        self.progress_text = tk.StringVar()
 
-    # For tracking which radio button is selected
-    direction = tk.IntVar(value=1)
+        # An array for holding all UI widgets that will need to be disabled
+        # during processing
+        self.ui_widgets = []
 
-    # For the progress bar
-    progress = tk.IntVar(value=0)
+        # For setting the users preferred timezone. Default to -7 cause that's
+        # where I live.
+        self.utc_offset = tk.IntVar(value=-7)
 
-    # An array for holding all UI widgets that will need to be disabled
-    # during processing
-    ui_widgets = []
+        self.bib_times = BibTimes()
+        self.bib_results_filename = tk.StringVar()
 
-    # For setting the users preferred timezone. Default to -7 cause that's
-    # where I live.
-    utc_offset = tk.IntVar(value=-7)
+        # Build the result in a disk-backed buffer instead of RAM
+        self.disk_backed = tk.BooleanVar(value=False)
 
-    # A flag that tracks if a video is being processed
-    is_processing = False
+        # (line_pos, line_pos_rotate) of lines extracted in addition to the
+        # one being edited
+        self.extra_lines = []
 
-    bib_times = BibTimes()
-    bib_results_filename = tk.StringVar()
+        # Finished results, so that processing a video again is instant
+        self.result_cache = ResultCache()
 
+        # Keeps the pixels of open results within a memory budget
+        self.result_store = ResultStore()
+
+        # Downscaled keyframes of the loaded video for the preview scrubber,
+        # and the pts of the one shown
+        self.scrubber = None
+        self.scrub_pts = None
+
+        # Keep one row in every downscale rows of the result
+        self.downscale = tk.IntVar(value=1)
+
+    def tab_changed(self, event):
+        """Reloads the result being looked at, evicting others if they no
+        longer fit in memory"""
+        selected = self.tab_control.select()
+        for result in self.results:
+            if str(result.tab) == selected:
+                self.result_store.touch(result)
+                break
 
     def enter_key(self, event):
         # Get active tab
@@ -340,6 +756,9 @@ class FinishLine:
         self.height = self.width
         self.width = height
         self.line_pos = int(self.width / 2)
+        # Extra lines and the band don't survive rotating the video
+        self.clear_lines()
+        self.clear_roi()
         self.tk_image = ImageTk.PhotoImage(self.preview_image)
         self.canvas.itemconfig(self.preview, image=self.tk_image)
         self.canvas.coords(
@@ -355,86 +774,193 @@ class FinishLine:
         self.canvas.config(scrollregion=(0, 0, self.width, self.height))
         self.canvas.pack()
         
-    def get_rotate_theta(self):
+    def get_rotate_theta(self, line_pos_rotate=None):
         """Returns the current rotation angle of the finish line in degrees"""
-        return math.atan2(self.line_pos_rotate, self.height / 2) * 180 / math.pi
-
-    def process(self):
-        """Constructs the result image from the video and the finish line. 
-        Fills in the results tab with the result, the finish line, and UI 
-        elements."""
-        start = time.time()
-        self.is_processing = True
-        container = av.open(self.file)
-        num_frames = int(container.streams.video[0].frames)
-        out = Image.new("RGB", (num_frames, self.height), (255, 255, 255))
-        result_array = np.ndarray((self.height, num_frames, 3))
-        results = []
-        frame_num = 0
-        theta = self.get_rotate_theta()
-        container.streams.video[0].thread_type = "AUTO"
-        with Pool() as pool:
-            for frame in container.decode(video=0):
-                results.append(pool.apply_async(
-                    sub_process, (
-                        (frame.to_ndarray(format="rgb24"), "rgb24"), 
-                        theta,
-                        self.rotation,
-                        self.line_pos,
-                        self.height,
-                        self.direction.get(),
-                        num_frames, 
-                        frame_num, 
-                    ), 
-                    error_callback=lambda error: print(error)
-                ))
-                # When all frames have been added to the pool, the the bar will be at
-                # 50%
-                self.progress.set(int(50 * frame_num / num_frames))
-                frame_num += 1
-                if self.is_processing is False:
-                    # Cancel was pressed
-                    pool.close()
-                    pool.terminate()
-                    self.process_finished()
-                    return 
-            
-            pool.close()
-            finished_processes = set()
-            num_processes = len(results)
-            while len(finished_processes) != num_processes:
-                if self.is_processing is False:
-                    # Cancel button was pressed
-                    pool.terminate()
-                    self.process_finished()
-                    return
-
-                for i, result in enumerate(results):
-                    if i not in finished_processes and result.ready():
-                        array, x = result.get()
-                        result_array[:, x, :] = array[:, 0, :]
-                        finished_processes.add(i)
-                        self.progress.set(
-                            50 + 
-                            int(50 * len(finished_processes) / num_processes)
-                        )
-
-        out = Image.fromarray(result_array.astype("uint8"), mode="RGB")
-            
-        self.results.append(
-            Result(
+        if line_pos_rotate is None:
+            line_pos_rotate = self.line_pos_rotate
+        return math.atan2(line_pos_rotate, self.height / 2) * 180 / math.pi
+
+    def add_line(self):
+        """Keeps the current finish line, so that another one can be placed.
+        All lines are extracted in the same pass over the video."""
+        if not self.canvas:
+            return
+        self.extra_lines.append((self.line_pos, self.line_pos_rotate))
+        self.canvas.create_line(
+            self.line_pos - self.line_pos_rotate,
+            0,
+            self.line_pos + self.line_pos_rotate,
+            self.height,
+            width=1,
+            tags="extra_line",
+            fill="#ffff00",
+        )
+
+    def clear_lines(self):
+        """Removes the lines added with add_line"""
+        self.extra_lines = []
+        if self.canvas:
+            self.canvas.delete("extra_line")
+
+    def get_lines(self):
+        """Returns (line_pos, theta) of every finish line to extract"""
+        lines = [
+            (line_pos, self.get_rotate_theta(line_pos_rotate))
+            for line_pos, line_pos_rotate in self.extra_lines
+        ]
+        lines.append((self.line_pos, self.get_rotate_theta()))
+        return lines
+
+    def get_cache_key(self, lines):
+        """Returns the result cache key of processing the loaded video with
+        the current settings, or None if it can't be cached"""
+        if is_capture_device(self.file):
+            return None
+        try:
+            return self.result_cache.key(
+                self.files if len(self.files) > 1 else self.file,
+                lines,
+                self.rotation,
+                self.direction.get(),
+                interpolation=self.interpolation,
+                start_seconds=self.window_start,
+                end_seconds=self.window_end,
+                roi=self.roi,
+                downscale=self.downscale.get(),
+            )
+        except OSError:
+            return None
+
+    def roi_started(self, event):
+        """Starts dragging out the band of rows to extract"""
+        self.roi_start = self.canvas.canvasy(event.y)
+
+    def roi_dragged(self, event):
+        top, bottom = sorted((self.roi_start, self.canvas.canvasy(event.y)))
+        top = int(max(top, 0))
+        bottom = int(min(bottom, self.height))
+        # A click without a drag clears the band
+        self.roi = (top, bottom) if bottom - top > 1 else None
+        self.canvas.delete("roi")
+        if self.roi:
+            self.canvas.create_rectangle(
+                0, top, self.width, bottom, outline="#00ffff", tags="roi"
+            )
+
+    def downscale_is_valid(self):
+        try:
+            if self.downscale.get() >= 1:
+                return True
+        except tk.TclError:
+            pass
+        show_error("The rows to keep must be 1 in every whole number of rows")
+        return False
+
+    def clear_roi(self):
+        """Extracts every row again"""
+        self.roi = None
+        if self.canvas:
+            self.canvas.delete("roi")
+
+    def process(self, job, lines, cache_key, options):
+        """Constructs the result arrays from the video and the finish lines.
+        Anything that can be cached is checkpointed as it goes, so an
+        interrupted run carries on where it stopped next time.
+        Runs on the job's thread, so nothing in here may touch the window.
+        Returns a ProcessedVideo, or None if cancelled."""
+        if cache_key:
+            processed = process_resumable(
+                cache_key,
+                self.files,
+                lines,
+                self.rotation,
+                is_cancelled=job.is_cancelled,
+                on_progress=job.progress,
+                cache=self.result_cache,
+                **options,
+            )
+        elif len(self.files) > 1:
+            processed = process_files(
+                self.files,
+                lines,
+                self.rotation,
+                is_cancelled=job.is_cancelled,
+                on_progress=job.progress,
+                **options,
+            )
+        else:
+            processed = process_video(
+                self.file,
+                lines,
+                self.rotation,
+                is_cancelled=job.is_cancelled,
+                on_progress=job.progress,
+                **options,
+            )
+        return processed
+
+    def show_progress(self, done, total, rate, seconds_left):
+        """Shows how far along the running job is"""
+        if total:
+            self.progress.set(int(100 * done / total))
+        text = f"{done}/{total} frames" if total else f"{done} frames"
+        if rate is not None:
+            text += f", {rate:.0f} fps"
+        if seconds_left is not None:
+            text += f", {format_seconds(seconds_left)} left"
+        self.progress_text.set(text)
+
+    def processing_done(self, processed, lines, cache_key):
+        if processed is not None:
+            self.show_results(processed, lines)
+        self.process_finished()
+        # Long runs were already moved into the cache from their checkpoint.
+        # Anything else, including a checkpoint that couldn't be moved, is
+        # copied in once its results are on screen.
+        if processed is not None and cache_key and not self.result_cache.has(cache_key):
+            run_job(
+                self.window,
+                Job(
+                    lambda job: self.result_cache.put(cache_key, processed),
+                    on_failed=lambda e: print(f"Failed to cache the result. {e}"),
+                ),
+            )
+
+    def processing_failed(self, e):
+        show_error(f"Failed to process the video. {e}")
+        self.process_finished()
+
+    def show_results(self, processed, lines):
+        """Adds a results tab for each finish line"""
+        # When only a window of the video was processed, the result starts
+        # that many frames after the start of the video
+        start_time = self.start_time + relativedelta(
+            seconds=processed.first_frame / self.fps
+        )
+        frame_source = None
+        if isinstance(processed.index, StitchedIndex):
+            frame_source = StitchedFrameSource(
+                processed.index, self.rotation, max_size=FRAME_VIEW_SIZE
+            )
+        elif processed.index is not None:
+            frame_source = FrameSource(
+                self.file, processed.index, self.rotation, max_size=FRAME_VIEW_SIZE
+            )
+        for i, result_array in enumerate(processed.result_arrays):
+            result = Result(
                 self.tab_control, 
-                out, self.direction.get(), 
-                self.start_time,
+                result_array, self.direction.get(), 
+                start_time,
                 self.fps,
-                self.bib_times
+                self.bib_times,
+                label=f"Line {i + 1}" if len(lines) > 1 else None,
+                stats=processed.stats,
+                frame_source=frame_source,
             )
-        )
-        finish = time.time()
-        print(f"That took {finish - start} s")
-        # Move to the results tab
-        self.tab_control.select(len(self.results))
-        self.process_finished()
+            self.results.append(result)
+            self.result_store.add(result)
+        # Move to the first new results tab
+        self.tab_control.select(len(self.results) - len(lines) + 1)
 
     def process_finished(self):
         # Re-enable disabled widgets
@@ -446,33 +972,39 @@ class FinishLine:
 
         # Reset the progress bar
         self.progress.set(0)
+        self.progress_text.set("")
 
-        self.is_processing = False
+        self.job = None
 
 
     def get_first_frame_from_video(self):
         """Opens the video's first frame and extracts some metadata for later use.
         Returns the first frame as an image."""
-        container = av.open(self.file)
-        self.metadata = container.metadata
-        self.length_seconds = container.duration / 10**6
-        self.playback_framerate = int(str(container.streams.video[0].base_rate))
-
-        start_time_str = self.metadata.get("creation_time", "")
-        if start_time_str:
-            self.start_time = parse(start_time_str)
-            self.start_time += relativedelta(hours=self.utc_offset.get())
-
-            if fps := self.metadata.get("com.android.capture.fps"):
-                self.fps = int(float(fps))
-                self.finish_time = self.start_time + relativedelta(
-                    seconds=self.length_seconds / (self.fps / self.playback_framerate)
-                )
-            else:
-                self.fps = 30
+        if is_capture_device(self.file):
+            # Nothing is known about a capture device until it is live
+            self.metadata = {}
+            self.length_seconds = None
+            self.playback_framerate = None
+            container = open_source(self.file)
+            try:
+                for frame in container.decode(video=0):
+                    return frame.to_image()
+            finally:
+                container.close()
+
+        info = VideoInfo(
+            self.file, utc_offset=self.utc_offset.get(), decode_first_frame=True
+        )
+        self.metadata = info.metadata
+        self.length_seconds = info.length_seconds
+        self.playback_framerate = info.playback_framerate
+
+        if info.start_time:
+            self.start_time = info.start_time
+            self.finish_time = info.finish_time
+            self.fps = info.fps
 
-        for frame in container.decode(video=0):
-            return frame.to_image()
+        return info.first_image
 
     def load_preview(self, preview_image):
         """Given the preview image, draws it onto the canvas. Draws the finish line. Creates the
@@ -514,12 +1046,52 @@ class FinishLine:
     def load_video(self):
         """Opens a file select dialog for the user to select a video. Loads a preview image
         into the canvas. Draws the finish line and slider controls."""
-        self.rotation = 0
         file = filedialog.askopenfilename()
         if not file:
             return
-        
+        self.open_video(file)
+
+    def load_videos(self):
+        """Opens a file select dialog for the user to select the consecutive
+        videos of one recording, such as the chunks a camera splits a long
+        recording into. They are processed as one video, in file name order.
+        The first one is previewed."""
+        files = filedialog.askopenfilenames()
+        if not files:
+            return
+        files = sorted(files)
+        self.open_video(files[0])
+        self.files = files
+
+    def load_capture_device(self):
+        """Asks for a capture device to use in live mode, and loads a preview
+        image from it"""
+        source = simpledialog.askstring(
+            "Capture Device",
+            "Device as format:device, e.g. v4l2:/dev/video0 or dshow:video=Camera",
+            parent=self.window,
+        )
+        if not source:
+            return
+        if not is_capture_device(source):
+            show_error(
+                f"Not a capture device. The format must be one of "
+                f"{', '.join(CAPTURE_FORMATS)}"
+            )
+            return
+        try:
+            self.open_video(source)
+        except (OSError, ValueError) as e:
+            show_error(f"Failed to open {source}. {e}")
+
+    def open_video(self, file):
+        """Loads a preview image of a video file or capture device into the
+        canvas. Draws the finish line and slider controls."""
+        self.rotation = 0
         self.file = file
+        self.files = [file]
+        self.extra_lines = []
+        self.roi = None
         self.preview_image = self.get_first_frame_from_video()
         self.width, self.height = self.preview_image.size
         self.line_pos = self.width / 2
@@ -547,14 +1119,104 @@ class FinishLine:
                 xscrollcommand=self.preview_hbar.set,
                 yscrollcommand=self.preview_vbar.set,
             )
+            self.canvas.bind("<Shift-Button-1>", self.roi_started)
+            self.canvas.bind("<Shift-B1-Motion>", self.roi_dragged)
 
         self.load_preview(self.preview_image)
 
+        # Pick a clearer frame than the first one from the keyframes
+        if self.scrubber:
+            self.scrubber.cancel()
+        self.scrubber = None
+        self.scrub_pts = None
+        self.frame_size = self.preview_image.size
+        self.scrub_slider.config(to=0)
+        self.scrub_slider.set(0)
+        if not is_capture_device(file):
+            self.scrubber = KeyframeScrubber(file)
+            self.poll_scrubber(self.scrubber)
+
+    def poll_scrubber(self, scrubber):
+        """Lets the scrubber reach the keyframes decoded so far"""
+        if scrubber is not self.scrubber:
+            return
+        self.scrub_slider.config(to=max(len(scrubber) - 1, 0))
+        if not scrubber.finished:
+            self.window.after(SCRUBBER_REFRESH_MS, self.poll_scrubber, scrubber)
+
+    def show_preview_image(self, image):
+        """Shows an unrotated video frame on the preview canvas"""
+        if image.size != self.frame_size:
+            image = image.resize(self.frame_size)
+        if self.rotation % 360:
+            image = image.rotate(self.rotation, expand=True)
+        self.preview_image = image
+        self.tk_image = ImageTk.PhotoImage(image)
+        self.canvas.itemconfig(self.preview, image=self.tk_image)
+
+    def scrub(self, *args):
+        """Shows the downscaled keyframe under the scrubber"""
+        if not self.scrubber or not len(self.scrubber):
+            return
+        self.scrub_pts, image = self.scrubber.preview(self.scrub_slider.get())
+        self.show_preview_image(image)
+
+    def scrub_released(self, event):
+        """Replaces the downscaled keyframe with the full resolution one, so
+        the line can be placed exactly"""
+        scrubber = self.scrubber
+        pts = self.scrub_pts
+        if not scrubber or pts is None:
+            return
+
+        def show(image):
+            if image and scrubber is self.scrubber and pts == self.scrub_pts:
+                self.show_preview_image(image)
+
+        run_job(
+            self.window,
+            Job(
+                lambda job: scrubber.full_frame(pts),
+                on_finished=show,
+                on_failed=lambda e: print(f"Failed to decode keyframe {pts}. {e}"),
+            ),
+        )
+
     def process_clicked(self):
         if not hasattr(self, "file"):
             # Nothing has been loaded yet.
             return
-        
+
+        try:
+            self.window_start = parse_seconds(self.window_start_entry.get())
+            self.window_end = parse_seconds(self.window_end_entry.get())
+        except ValueError:
+            show_error("Start and end must be given in seconds, or as mm:ss")
+            return
+        if len(self.files) > 1 and (self.window_start or self.window_end is not None):
+            show_error("Start and end can't be used with several videos")
+            return
+        if not self.downscale_is_valid():
+            return
+
+        lines = self.get_lines()
+        cache_key = self.get_cache_key(lines)
+        if cache_key and (processed := self.result_cache.get(cache_key)):
+            self.show_results(processed, lines)
+            return
+
+        # Everything the processing needs from the window is read here, as
+        # it runs on its own thread
+        options = dict(
+            direction=self.direction.get(),
+            interpolation=self.interpolation,
+            disk_backed=self.disk_backed.get(),
+            roi=self.roi,
+            downscale=self.downscale.get(),
+        )
+        if len(self.files) == 1:
+            options.update(start_seconds=self.window_start, end_seconds=self.window_end)
+
         # Start the processing in its own thread so that we don't lock up the window
         # and we can draw the progress bar.
         for widget in self.ui_widgets:
@@ -563,15 +1225,120 @@ class FinishLine:
         # enable the cancel button
         self.cancel_btn.config(state="normal")
 
-        Thread(target=self.process).start()
+        self.job = run_job(
+            self.window,
+            Job(
+                lambda job: self.process(job, lines, cache_key, options),
+                on_progress=self.show_progress,
+                on_finished=lambda processed: self.processing_done(
+                    processed, lines, cache_key
+                ),
+                on_failed=self.processing_failed,
+            ),
+        )
+
+    def go_live_clicked(self):
+        """Builds results while the video is still being recorded"""
+        if not hasattr(self, "file"):
+            # Nothing has been loaded yet.
+            return
+        if not self.downscale_is_valid():
+            return
+
+        for widget in self.ui_widgets:
+            widget.config(state="disabled")
+        self.cancel_btn.config(state="normal")
+
+        self.job = Job(
+            lambda job: extractor.run(),
+            on_failed=lambda e: show_error(f"Live mode stopped. {e}"),
+        )
+        lines = self.get_lines()
+        extractor = LiveExtractor(
+            self.file,
+            lines,
+            self.rotation,
+            self.direction.get(),
+            interpolation=self.interpolation,
+            is_cancelled=self.job.is_cancelled,
+            roi=self.roi,
+            downscale=self.downscale.get(),
+        )
+        self.job.start()
+        self.poll_live(extractor, self.job, [])
+
+    def poll_live(self, extractor, job, results):
+        """Shows what live mode has extracted so far. Runs on the Tk thread
+        every LIVE_REFRESH_MS until live mode stops."""
+        finished = not job.poll()
+        if extractor.results and not results:
+            if is_capture_device(self.file):
+                # There is no metadata, so time from the first frame
+                start_time = datetime.now()
+                fps = round(extractor.fps)
+            else:
+                # Columns start at the first frame that could be read
+                start_time = self.start_time + relativedelta(
+                    seconds=extractor.first_frame / self.fps
+                )
+                fps = self.fps
+            for i, growing in enumerate(extractor.results):
+                results.append(
+                    Result(
+                        self.tab_control,
+                        growing.view(),
+                        self.direction.get(),
+                        start_time,
+                        fps,
+                        self.bib_times,
+                        label=f"Line {i + 1}" if len(extractor.lines) > 1 else None,
+                        stats=extractor.stats,
+                    )
+                )
+            self.results.extend(results)
+            for result in results:
+                self.result_store.add(result)
+            self.tab_control.select(results[0].tab)
+        for result, growing in zip(results, extractor.results):
+            result.refresh(growing.view(), final=finished)
+
+        if finished:
+            self.process_finished()
+        else:
+            self.window.after(
+                LIVE_REFRESH_MS, self.poll_live, extractor, job, results
+            )
 
     def cancel_processing(self):
-        self.is_processing = False
+        if self.job:
+            self.job.cancel()
 
     def bib_results_filename_update(self):
-        self.bib_times.bib_results_filename = self.bib_results_filename.get()
+        try:
+            self.bib_times.bib_results_filename = self.bib_results_filename.get()
+        except CompactionError as e:
+            show_error(f"Failed to write the times to the new csv. {e}")
         return True
 
+    def compact_bib_times(self):
+        """Writes out the bib times entered since the CSV was last written,
+        every COMPACT_SECONDS"""
+        try:
+            self.bib_times.compact_if_due()
+        except CompactionError as e:
+            # The journal is kept, and the next entry shows the error
+            print(f"Failed to write {self.bib_times.csv_path}. {e}")
+        self.window.after(COMPACT_SECONDS * 1000, self.compact_bib_times)
+
+    def close(self):
+        """Writes out the bib times before closing the window"""
+        try:
+            self.bib_times.close()
+        except CompactionError as e:
+            # The journal is kept, so the times are recovered next time
+            print(f"Failed to write {self.bib_times.csv_path}. {e}")
+        self.window.destroy()
+
     def main(self):
         """Draws the UI and starts the main tkinter loop"""
         rotate_frame = ttk.Frame(self.tab_1)
@@ -580,6 +1347,22 @@ class FinishLine:
         )
         self.ui_widgets.append(load_video_btn)
         load_video_btn.pack(fill=tk.Y, side=tk.LEFT)
+        load_videos_btn = ttk.Button(
+            rotate_frame,
+            text="Load Consecutive Videos",
+            width=30,
+            command=self.load_videos,
+        )
+        self.ui_widgets.append(load_videos_btn)
+        load_videos_btn.pack(fill=tk.Y, side=tk.LEFT)
+        load_device_btn = ttk.Button(
+            rotate_frame,
+            text="Load Capture Device",
+            width=30,
+            command=self.load_capture_device,
+        )
+        self.ui_widgets.append(load_device_btn)
+        load_device_btn.pack(fill=tk.Y, side=tk.LEFT)
         rotate_image_ccw_btn = ttk.Button(
             rotate_frame,
             text="Rotate Video 90 deg CCW",
@@ -600,6 +1383,23 @@ class FinishLine:
 
         rotate_frame.pack(fill=tk.X, side=tk.TOP)
 
+        # Scrubs through the keyframes, to align the line on a clear frame
+        scrub_frame = ttk.Frame(self.tab_1)
+        scrub_label = tk.Label(scrub_frame, text="Preview frame")
+        scrub_label.pack(fill=tk.X, side=tk.LEFT)
+        self.scrub_slider = tk.Scale(
+            scrub_frame,
+            from_=0,
+            to=0,
+            orient=tk.HORIZONTAL,
+            showvalue=False,
+            command=self.scrub,
+        )
+        self.scrub_slider.bind("<ButtonRelease-1>", self.scrub_released)
+        self.ui_widgets.append(self.scrub_slider)
+        self.scrub_slider.pack(expand=True, fill=tk.X, side=tk.LEFT)
+        scrub_frame.pack(fill=tk.X, side=tk.TOP)
+
         line_frame = ttk.Frame(self.tab_1)
         rotate_ccw_btn = ttk.Button(
             line_frame,
@@ -619,8 +1419,45 @@ class FinishLine:
         self.ui_widgets.append(rotate_cw_btn)
         rotate_cw_btn.pack(fill=tk.Y, side=tk.LEFT)
 
+        add_line_btn = ttk.Button(
+            line_frame,
+            text="Add Another Line",
+            width=20,
+            command=self.add_line,
+        )
+        self.ui_widgets.append(add_line_btn)
+        add_line_btn.pack(fill=tk.Y, side=tk.LEFT)
+
+        clear_lines_btn = ttk.Button(
+            line_frame,
+            text="Clear Extra Lines",
+            width=20,
+            command=self.clear_lines,
+        )
+        self.ui_widgets.append(clear_lines_btn)
+        clear_lines_btn.pack(fill=tk.Y, side=tk.LEFT)
+
         line_frame.pack(fill=tk.X, side=tk.TOP)
 
+        # Only the rows in the band are extracted. It is dragged out on the
+        # preview with shift held down.
+        roi_frame = ttk.Frame(self.tab_1)
+        roi_label = tk.Label(roi_frame, text="Rows to keep: shift-drag on the preview")
+        roi_label.pack(fill=tk.X, side=tk.LEFT)
+        clear_roi_btn = ttk.Button(
+            roi_frame, text="Keep All Rows", width=20, command=self.clear_roi
+        )
+        self.ui_widgets.append(clear_roi_btn)
+        clear_roi_btn.pack(fill=tk.Y, side=tk.LEFT)
+        downscale_label = tk.Label(roi_frame, text="Keep 1 row in every")
+        downscale_label.pack(fill=tk.X, side=tk.LEFT)
+        downscale = ttk.Spinbox(
+            roi_frame, from_=1, to=8, width=5, textvariable=self.downscale
+        )
+        self.ui_widgets.append(downscale)
+        downscale.pack(fill=tk.X, side=tk.LEFT)
+        roi_frame.pack(fill=tk.X, side=tk.TOP)
+
         radio_frame = ttk.Frame(self.tab_1)
         radio_frame.pack(fill=tk.X, side=tk.TOP)
         radio_label = tk.Label(radio_frame, text="Direction of travel")
@@ -644,6 +1481,21 @@ class FinishLine:
         utc_offset = ttk.Spinbox(utc_offset_frame, from_=-24, to=24, wrap=True, textvariable=self.utc_offset)
         utc_offset.pack(fill=tk.X, side=tk.LEFT)
 
+        # Optionally only process part of the video. Blank means from the
+        # start, or to the end.
+        window_frame = ttk.Frame(self.tab_1)
+        window_frame.pack(fill=tk.X, side=tk.TOP)
+        window_start_label = tk.Label(window_frame, text="Process from (mm:ss)")
+        window_start_label.pack(fill=tk.X, side=tk.LEFT)
+        self.window_start_entry = ttk.Entry(window_frame, width=10)
+        self.ui_widgets.append(self.window_start_entry)
+        self.window_start_entry.pack(fill=tk.X, side=tk.LEFT)
+        window_end_label = tk.Label(window_frame, text="to (mm:ss)")
+        window_end_label.pack(fill=tk.X, side=tk.LEFT)
+        self.window_end_entry = ttk.Entry(window_frame, width=10)
+        self.ui_widgets.append(self.window_end_entry)
+        self.window_end_entry.pack(fill=tk.X, side=tk.LEFT)
+
         bib_results_frame = ttk.Frame(self.tab_1)
         bib_results_frame.pack(fill=tk.X, side=tk.TOP)
         bib_results_label = tk.Label(bib_results_frame, text="Bib Results Filename")
@@ -663,8 +1515,16 @@ class FinishLine:
         )
         self.ui_widgets.append(process_btn)
         process_btn.pack(fill=tk.X, side=tk.LEFT)
+        live_btn = ttk.Button(
+            process_frame, text="Go Live", width=10, command=self.go_live_clicked
+        )
+        self.ui_widgets.append(live_btn)
+        live_btn.pack(fill=tk.X, side=tk.LEFT)
         progress_bar = ttk.Progressbar(process_frame, length=300, variable=self.progress, maximum=100)
         progress_bar.pack(fill=tk.X, side=tk.LEFT)
+        ttk.Label(process_frame, textvariable=self.progress_text, width=32).pack(
+            fill=tk.X, side=tk.LEFT
+        )
         process_frame.pack(fill=tk.X, side=tk.TOP)
 
         self.cancel_btn = ttk.Button(
@@ -672,7 +1532,16 @@ class FinishLine:
         )
         self.cancel_btn.pack(fill=tk.X, side=tk.LEFT)
 
+        disk_backed_btn = ttk.Checkbutton(
+            process_frame, text="Disk-backed result (very long videos)", variable=self.disk_backed
+        )
+        self.ui_widgets.append(disk_backed_btn)
+        disk_backed_btn.pack(fill=tk.X, side=tk.LEFT)
+
         self.window.bind("<Return>", self.enter_key)
+        self.tab_control.bind("<<NotebookTabChanged>>", self.tab_changed)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.window.after(COMPACT_SECONDS * 1000, self.compact_bib_times)
         tk.mainloop()
 
 
@@ -0,0 +1,93 @@
+"""Downscaled keyframes for scrubbing through a video in the preview, so that
+a clear frame can be picked to line the finish line up on.
+
+Only keyframes are decoded, which needs no reference frames and is many
+times faster than decoding every frame, and they are shrunk as they are
+converted."""
+from threading import Lock, Thread
+
+import av
+
+from processing import seek_frames
+
+
+# Width of the downscaled keyframes, in pixels
+PREVIEW_WIDTH = 480
+
+# Most keyframes kept. Past this every other one is dropped, so the ones kept
+# stay spread evenly over the whole video.
+MAX_PREVIEW_FRAMES = 256
+
+
+class KeyframeScrubber:
+    """Decodes the keyframes of a video into a bounded cache on a background
+    thread. frames can be read while it is still being filled."""
+
+    def __init__(self, file, width=PREVIEW_WIDTH, max_frames=MAX_PREVIEW_FRAMES):
+        self.file = file
+        self.width = width
+        self.max_frames = max_frames
+        # (pts, downscaled PIL image) of every step-th keyframe
+        self.frames = []
+        self.step = 1
+        self.lock = Lock()
+        self.cancelled = False
+        self.finished = False
+        Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        try:
+            container = av.open(self.file)
+        except (OSError, ValueError):
+            self.finished = True
+            return
+        try:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            stream.codec_context.skip_frame = "NONKEY"
+            frame_width = stream.codec_context.width
+            frame_height = stream.codec_context.height
+            width = min(self.width, frame_width)
+            height = max(round(frame_height * width / frame_width), 1)
+            for n, frame in enumerate(container.decode(stream)):
+                if self.cancelled:
+                    break
+                if n % self.step or frame.pts is None:
+                    continue
+                image = frame.reformat(width, height, format="rgb24").to_image()
+                with self.lock:
+                    self.frames.append((frame.pts, image))
+                    if len(self.frames) > self.max_frames:
+                        self.frames = self.frames[::2]
+                        self.step *= 2
+        except (OSError, ValueError):
+            # Show whatever was decoded before the error
+            pass
+        finally:
+            container.close()
+            self.finished = True
+
+    def __len__(self):
+        return len(self.frames)
+
+    def preview(self, i):
+        """Returns the pts and downscaled image of keyframe i. Keyframes are
+        dropped as the cache fills up, so i only means the same keyframe
+        until then, and the pts is what identifies it."""
+        with self.lock:
+            return self.frames[min(i, len(self.frames) - 1)]
+
+    def full_frame(self, pts):
+        """Decodes the keyframe at pts at full resolution. Returns a PIL
+        image."""
+        container = av.open(self.file)
+        try:
+            stream = container.streams.video[0]
+            for frame in seek_frames(container, stream, pts):
+                if frame.pts is not None and frame.pts >= pts:
+                    return frame.to_image()
+        finally:
+            container.close()
+
+    def cancel(self):
+        self.cancelled = True
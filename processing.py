@@ -0,0 +1,1315 @@
+"""The video processing core of FinishLine. Nothing in here depends on
+tkinter, so it is shared by the GUI in main.py and the headless batch mode
+in batch.py."""
+from concurrent.futures import (
+    Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait,
+    FIRST_COMPLETED,
+)
+from contextlib import contextmanager
+import copy
+import itertools
+import math
+import multiprocessing
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+import time
+
+import av
+from dateutil.parser import parse
+from dateutil.relativedelta import relativedelta
+import numpy as np
+
+
+def allocate_result_array(height, width, disk_backed=False):
+    """Preallocates the uint8 buffer that columns are written into. When
+    disk_backed is set, the buffer is a numpy.memmap over an anonymous
+    temporary file, so results longer than RAM can still be built. The file
+    is removed as soon as the buffer is released."""
+    shape = (height, width, 3)
+    if disk_backed:
+        return np.memmap(
+            tempfile.TemporaryFile(prefix="finishline-"),
+            dtype=np.uint8,
+            mode="w+",
+            shape=shape,
+        )
+    return np.zeros(shape, dtype=np.uint8)
+
+
+def get_column_index(direction, num_frames, frame_num):
+    """Returns the x position in the result image for the given frame"""
+    if direction > 0:
+        return num_frames - frame_num - 1
+    return frame_num
+
+
+class LineSampler:
+    """Samples the finish line out of decoded frames.
+
+    The pixel coordinates of the line, as drawn on the (possibly 90 degree
+    rotated) preview, are mapped back onto the decoded frame once. Every
+    frame after that is a single vectorized gather, so a tilted line costs
+    about the same as a straight one.
+
+    roi is an optional (top, bottom) band of preview rows to keep, and
+    downscale keeps one row in every downscale rows of it. Rows outside of
+    what is kept are never read, so the work and the result shrink with
+    them."""
+
+    def __init__(
+        self, frame_width, frame_height, line_pos, theta, rotation,
+        interpolation="bilinear", roi=None, downscale=1,
+    ):
+        k = round(rotation / 90) % 4
+        if k % 2:
+            width, height = frame_height, frame_width
+        else:
+            width, height = frame_width, frame_height
+
+        top, bottom = 0, height
+        if roi is not None:
+            top = min(max(int(roi[0]), 0), height - 1)
+            bottom = min(max(int(roi[1]), top + 1), height)
+        downscale = max(int(downscale), 1)
+
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+
+        # Position of the line in the rotated preview, one sample per kept
+        # row, taken from the middle of each block of downscale rows
+        ys = np.arange(top, bottom, downscale, dtype=np.float64)
+        ys = np.minimum(ys + (downscale - 1) // 2, bottom - 1)
+        self.height = len(ys)
+        xs = line_pos + (ys - height / 2) * math.tan(math.radians(theta))
+        if not theta:
+            xs = np.full(len(ys), float(int(line_pos)))
+
+        # Map preview coordinates back onto the decoded frame, undoing
+        # np.rot90(frame, k)
+        if k == 0:
+            rows, cols = ys, xs
+        elif k == 1:
+            rows, cols = xs, frame_width - 1 - ys
+        elif k == 2:
+            rows, cols = frame_height - 1 - ys, frame_width - 1 - xs
+        else:
+            rows, cols = frame_height - 1 - xs, ys
+
+        rows = np.clip(rows, 0, frame_height - 1)
+        cols = np.clip(cols, 0, frame_width - 1)
+
+        # Nearest sample positions in 2x2 subsampled chroma planes
+        self.chroma_rows = np.rint(rows).astype(np.intp) // 2
+        self.chroma_cols = np.rint(cols).astype(np.intp) // 2
+
+        if interpolation == "nearest" or not theta:
+            self.interpolation = "nearest"
+            self.rows = np.rint(rows).astype(np.intp)
+            self.cols = np.rint(cols).astype(np.intp)
+        elif interpolation == "bilinear":
+            self.interpolation = "bilinear"
+            r0 = np.floor(rows).astype(np.intp)
+            c0 = np.floor(cols).astype(np.intp)
+            self.rows = r0
+            self.cols = c0
+            self.rows_1 = np.minimum(r0 + 1, frame_height - 1)
+            self.cols_1 = np.minimum(c0 + 1, frame_width - 1)
+            self.row_weight = rows - r0
+            self.col_weight = cols - c0
+        else:
+            raise ValueError(f"Unknown interpolation {interpolation}")
+
+    def gather(self, array):
+        """Returns the finish line of a (height, width) plane or a (height,
+        width, channels) frame array. Bilinear samples are returned as floats."""
+        if self.interpolation == "nearest":
+            return array[self.rows, self.cols]
+
+        row_weight = self.row_weight
+        col_weight = self.col_weight
+        if array.ndim == 3:
+            row_weight = row_weight[:, np.newaxis]
+            col_weight = col_weight[:, np.newaxis]
+        top = (
+            array[self.rows, self.cols] * (1 - col_weight)
+            + array[self.rows, self.cols_1] * col_weight
+        )
+        bottom = (
+            array[self.rows_1, self.cols] * (1 - col_weight)
+            + array[self.rows_1, self.cols_1] * col_weight
+        )
+        return top * (1 - row_weight) + bottom * row_weight
+
+    def sample(self, array):
+        """Returns the finish line of a (height, width, channels) frame array
+        as a (line height, channels) uint8 array"""
+        line = self.gather(array)
+        if self.interpolation == "nearest":
+            return line
+        return np.rint(line).astype(np.uint8)
+
+    def sample_yuv(self, y, u, v, full_range=False):
+        """Returns the finish line of a frame given as 4:2:0 Y, U and V planes,
+        converted to RGB the same way swscale does (BT.601), as a (line
+        height, 3) uint8 array. Only the pixels on the line are converted."""
+        luma = self.gather(y).astype(np.float32)
+        cb = u[self.chroma_rows, self.chroma_cols].astype(np.float32) - 128
+        cr = v[self.chroma_rows, self.chroma_cols].astype(np.float32) - 128
+        if full_range:
+            r = luma + 1.402 * cr
+            g = luma - 0.344136 * cb - 0.714136 * cr
+            b = luma + 1.772 * cb
+        else:
+            luma = 1.164383 * (luma - 16)
+            r = luma + 1.596027 * cr
+            g = luma - 0.391762 * cb - 0.812968 * cr
+            b = luma + 2.017232 * cb
+        line = np.stack([r, g, b], axis=-1)
+        return np.clip(np.rint(line), 0, 255).astype(np.uint8)
+
+
+def make_samplers(
+    frame_width, frame_height, lines, rotation, interpolation="bilinear",
+    roi=None, downscale=1,
+):
+    """Returns a LineSampler for each (line_pos, theta) pair of lines"""
+    return [
+        LineSampler(
+            frame_width,
+            frame_height,
+            line_pos,
+            theta,
+            rotation,
+            interpolation=interpolation,
+            roi=roi,
+            downscale=downscale,
+        )
+        for line_pos, theta in lines
+    ]
+
+
+class ProcessingStats:
+    """Per-stage timings and counters collected while processing a video.
+
+    Stages are timed cumulatively with time(). Worker processes collect
+    their own stats, which are merged back in with merge()."""
+
+    def __init__(self):
+        self.backend = None
+        self.frames = 0
+        self.workers = 0
+        self.wall_seconds = 0.0
+        # Bytes pickled between processes, in both directions
+        self.ipc_bytes = 0
+        # Seconds workers spent doing work, for their utilization
+        self.busy_seconds = 0.0
+        # stage name -> [seconds, calls]
+        self.stages = {}
+        self.queue_depth_total = 0
+        self.queue_depth_samples = 0
+        self.queue_depth_max = 0
+        self.lock = Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def add(self, stage, seconds, calls=1):
+        with self.lock:
+            totals = self.stages.setdefault(stage, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += calls
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def sample_queue_depth(self, depth):
+        self.queue_depth_total += depth
+        self.queue_depth_samples += 1
+        self.queue_depth_max = max(self.queue_depth_max, depth)
+
+    def merge(self, other):
+        """Adds the stages and counters of a worker's stats to these"""
+        for stage, (seconds, calls) in other.stages.items():
+            self.add(stage, seconds, calls)
+        self.busy_seconds += other.busy_seconds
+
+    def report(self):
+        """Returns the stats as a JSON serializable dict"""
+        stages = {}
+        for stage, (seconds, calls) in self.stages.items():
+            stages[stage] = {
+                "seconds": round(seconds, 4),
+                "calls": calls,
+                "ms_per_call": round(1000 * seconds / calls, 4) if calls else None,
+                "calls_per_second": round(calls / seconds, 1) if seconds else None,
+            }
+        utilization = None
+        if self.workers and self.wall_seconds:
+            utilization = round(
+                self.busy_seconds / (self.workers * self.wall_seconds), 3
+            )
+        return {
+            "backend": self.backend,
+            "frames": self.frames,
+            "wall_seconds": round(self.wall_seconds, 4),
+            "frames_per_second": (
+                round(self.frames / self.wall_seconds, 1) if self.wall_seconds else None
+            ),
+            "workers": self.workers,
+            "worker_utilization": utilization,
+            "queue_depth_mean": (
+                round(self.queue_depth_total / self.queue_depth_samples, 2)
+                if self.queue_depth_samples else None
+            ),
+            "queue_depth_max": self.queue_depth_max,
+            "ipc_bytes": self.ipc_bytes,
+            "stages": stages,
+        }
+
+    def format(self):
+        """Returns the stats as human readable text"""
+        report = self.report()
+        lines = [
+            f"Backend: {report['backend']} with {report['workers']} workers",
+            f"{report['frames']} frames in {report['wall_seconds']} s "
+            f"({report['frames_per_second']} frames/s)",
+            f"Worker utilization: {report['worker_utilization']}",
+            f"Queue depth: mean {report['queue_depth_mean']}, max {report['queue_depth_max']}",
+            f"Between processes: {report['ipc_bytes'] / 2**20:.1f} MiB",
+        ]
+        for stage, values in report["stages"].items():
+            lines.append(
+                f"{stage}: {values['seconds']} s over {values['calls']} calls "
+                f"({values['ms_per_call']} ms each)"
+            )
+        return "\n".join(lines)
+
+
+# 4:2:0 formats whose planes can be sampled directly, and whether they use
+# the full 0-255 range
+YUV420_FORMATS = {"yuv420p": False, "yuvj420p": True}
+
+
+def plane_array(plane):
+    """Returns a (height, width) view of a frame plane, without copying"""
+    array = np.frombuffer(plane, dtype=np.uint8)
+    return array.reshape(plane.height, plane.line_size)[:, :plane.width]
+
+
+def sample_lines(frame, samplers, stats):
+    """Samples every line from a decoded frame. 4:2:0 frames are read straight
+    from their native planes, so only the pixels on the lines are ever
+    converted to RGB. Anything else goes through a full frame conversion."""
+    start = time.perf_counter()
+    full_range = YUV420_FORMATS.get(frame.format.name)
+    if full_range is not None:
+        y, u, v = (plane_array(plane) for plane in frame.planes)
+        converted = time.perf_counter()
+        lines = [sampler.sample_yuv(y, u, v, full_range) for sampler in samplers]
+    else:
+        array = frame.to_ndarray(format="rgb24")
+        converted = time.perf_counter()
+        lines = [sampler.sample(array) for sampler in samplers]
+    finish = time.perf_counter()
+
+    stats.add("convert", converted - start)
+    stats.add("sample", finish - converted)
+    with stats.lock:
+        stats.busy_seconds += finish - start
+    return lines
+
+
+BACKENDS = ["inline", "thread", "process"]
+
+# Rough costs behind choose_backend, measured on H.264 with a laptop CPU.
+# Only their ratios matter.
+DECODE_SECONDS_PER_PIXEL = 6e-9
+CONVERT_SECONDS_PER_PIXEL = 1.2e-9
+SAMPLE_SECONDS_PER_ROW = {"nearest": 1e-7, "bilinear": 1.8e-7}
+# Submitting a frame to a thread pool and collecting its lines
+THREAD_HANDOFF_SECONDS = 3e-5
+# Starting a worker process. Far more where processes are spawned rather
+# than forked, so this errs on the high side.
+PROCESS_STARTUP_SECONDS = 0.2
+IPC_BYTES_PER_SECOND = 1e9
+# How much of each extra core FFmpeg's own frame threads make use of when a
+# single stream is decoded
+FRAME_THREADING_EFFICIENCY = 0.5
+
+
+class InlineExecutor(Executor):
+    """Runs every task on the calling thread as soon as it is submitted"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+# How often a wait for workers stops to check whether it has been cancelled
+CANCEL_POLL_SECONDS = 0.1
+
+# Set in every worker process of the process backend. Segments stop as soon
+# as it is set, rather than running to the end after a cancel.
+worker_cancelled = None
+
+
+def init_worker(cancelled):
+    global worker_cancelled
+    worker_cancelled = cancelled
+
+
+def make_executor(backend, workers, cancelled=None):
+    """Returns the Executor of a backend. cancelled is a
+    multiprocessing.Event handed to the workers of the process backend."""
+    if backend == "inline":
+        return InlineExecutor()
+    if backend == "thread":
+        return ThreadPoolExecutor(max_workers=workers)
+    if backend == "process":
+        return ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(cancelled,)
+        )
+    raise ValueError(f"Unknown backend {backend}")
+
+
+def estimate_seconds(
+    frame_width, frame_height, num_frames, samplers, workers, yuv420=True,
+):
+    """Estimates how long each backend would take to process num_frames
+    frames, from the frame size, the lines (whose length depends on the
+    rotation) and the number of cores. Returns {backend: seconds}."""
+    pixels = frame_width * frame_height
+    decode = pixels * DECODE_SECONDS_PER_PIXEL
+    sample = sum(
+        sampler.height * SAMPLE_SECONDS_PER_ROW[sampler.interpolation]
+        for sampler in samplers
+    )
+    if not yuv420:
+        sample += pixels * CONVERT_SECONDS_PER_PIXEL
+    stream_decode = decode / (1 + (workers - 1) * FRAME_THREADING_EFFICIENCY)
+    result_bytes = num_frames * sum(sampler.height * 3 for sampler in samplers)
+    return {
+        "inline": num_frames * (stream_decode + sample),
+        # Sampling overlaps with decoding, at the cost of a handoff per frame
+        "thread": num_frames * (
+            max(stream_decode, sample / max(workers - 1, 1)) + THREAD_HANDOFF_SECONDS
+        ),
+        "process": (
+            workers * PROCESS_STARTUP_SECONDS
+            + num_frames * (decode + sample) / workers
+            + result_bytes / IPC_BYTES_PER_SECOND
+        ),
+    }
+
+
+def choose_backend(container, samplers, workers, start_seconds=None, end_seconds=None):
+    """Picks the backend that the cost model expects to be fastest. A single
+    core always runs inline, and short clips never pay for starting
+    processes."""
+    if workers <= 1:
+        return "inline"
+    stream = container.streams.video[0]
+    rate = float(stream.average_rate or stream.base_rate or 30)
+    if stream.duration:
+        seconds = float(stream.duration * stream.time_base)
+    elif container.duration:
+        seconds = container.duration / 10**6
+    else:
+        seconds = stream.frames / rate
+    if end_seconds is not None:
+        seconds = min(seconds, end_seconds)
+    seconds -= start_seconds or 0
+    estimates = estimate_seconds(
+        stream.codec_context.width,
+        stream.codec_context.height,
+        max(int(seconds * rate), 0),
+        samplers,
+        workers,
+        yuv420=stream.codec_context.pix_fmt in YUV420_FORMATS,
+    )
+    return min(estimates, key=estimates.get)
+
+
+def timed_frames(frames, stats):
+    """Yields from a frame iterator, timing each frame as the decode stage"""
+    frames = iter(frames)
+    while True:
+        start = time.perf_counter()
+        try:
+            frame = next(frames)
+        except StopIteration:
+            return
+        stats.add("decode", time.perf_counter() - start)
+        yield frame
+
+
+# A seek that lands past its target is tried again this many seconds
+# further back, twice as far every time after that
+SEEK_BACKOFF_SECONDS = 1
+
+
+def seek_frames(container, stream, pts, read=None, rewind=False):
+    """Seeks to the last keyframe at or before pts and returns read(), an
+    iterator over the frames of the stream by default, from there.
+
+    Some demuxers, MPEG-TS among them, land on the first keyframe after pts
+    instead, so while the first frame read is past pts this seeks again
+    further back. A stream that hasn't been read yet starts at its first
+    frame anyway, so pts at or before the start of the stream is only
+    seeked to with rewind."""
+    if read is None:
+        read = lambda: container.decode(stream)
+    stream_start = stream.start_time or 0
+    if pts <= stream_start and not rewind:
+        return read()
+    backoff = max(int(SEEK_BACKOFF_SECONDS / stream.time_base), 1)
+    target = pts
+    while True:
+        container.seek(target, stream=stream)
+        items = read()
+        first = next((item for item in items if item.pts is not None), None)
+        if (first is not None and first.pts <= pts) or target < stream_start:
+            return itertools.chain([] if first is None else [first], items)
+        target -= backoff
+        backoff *= 2
+
+
+def extract_columns(
+    frames, samplers, result_arrays, direction, num_frames,
+    is_cancelled=None, on_progress=None, workers=None, max_in_flight=None,
+    index=None, stats=None, timestamps=None, backend="thread",
+):
+    """Streams decoded frames through the line samplers and writes each
+    column straight into the matching result array as soon as it is ready.
+    Every frame is decoded and converted once, however many lines there are.
+
+    With the thread backend, colour conversion and sampling run on a thread
+    pool while the calling thread keeps decoding. At most max_in_flight
+    frames are alive at once, so memory stays flat no matter how long the
+    video is. The inline backend does everything on the calling thread. If a VideoIndex is
+    given, frames are placed by their presentation timestamp and frames
+    outside of it are skipped. If a timestamps list is given, the (pts,
+    is_keyframe) pair of every frame written is appended to it. Returns the
+    number of frames written, or None if cancelled."""
+    workers = workers or os.cpu_count() or 1
+    if backend == "inline":
+        workers = 1
+    max_in_flight = max_in_flight or 4 * workers
+    stats = stats or ProcessingStats()
+    stats.workers = workers
+    in_flight = {}
+    frames_done = 0
+
+    def collect(return_when):
+        nonlocal frames_done
+        done, _ = wait(in_flight, CANCEL_POLL_SECONDS, return_when)
+        with stats.time("assemble"):
+            for future in done:
+                x = in_flight.pop(future)
+                for result_array, column in zip(result_arrays, future.result()):
+                    result_array[:, x, :] = column
+                frames_done += 1
+        if on_progress:
+            on_progress(frames_done, num_frames)
+
+    with make_executor(backend, workers) as executor:
+        try:
+            for frame_num, frame in enumerate(timed_frames(frames, stats)):
+                if is_cancelled and is_cancelled():
+                    return None
+                if index is not None:
+                    if frame.pts is not None and frame.pts > index.pts[-1]:
+                        break
+                    frame_num = index.frame_number(frame.pts)
+                    if frame_num is None:
+                        continue
+                elif frame_num >= num_frames:
+                    break
+
+                if timestamps is not None:
+                    timestamps.append((frame.pts, frame.key_frame))
+                x = get_column_index(direction, num_frames, frame_num)
+                in_flight[executor.submit(sample_lines, frame, samplers, stats)] = x
+                stats.sample_queue_depth(len(in_flight))
+
+                # Back pressure. Stop decoding until the pool has caught up.
+                while len(in_flight) >= max_in_flight:
+                    if is_cancelled and is_cancelled():
+                        return None
+                    collect(FIRST_COMPLETED)
+
+            while in_flight:
+                if is_cancelled and is_cancelled():
+                    return None
+                collect(FIRST_COMPLETED)
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    return frames_done
+
+
+class VideoInfo:
+    """Metadata needed to time a result image. With decode_first_frame, the
+    first frame is also decoded into first_image, from the same container."""
+
+    def __init__(self, file, utc_offset=0, decode_first_frame=False):
+        container = av.open(file)
+        self.first_image = None
+        try:
+            stream = container.streams.video[0]
+            self.metadata = container.metadata
+            # Unknown for a file that is still being recorded
+            self.length_seconds = (
+                container.duration / 10**6 if container.duration else None
+            )
+            self.playback_framerate = int(str(stream.base_rate))
+            self.num_frames = int(stream.frames)
+            self.frame_width = stream.codec_context.width
+            self.frame_height = stream.codec_context.height
+            if decode_first_frame:
+                for frame in container.decode(stream):
+                    self.first_image = frame.to_image()
+                    break
+        finally:
+            container.close()
+
+        self.start_time = None
+        self.finish_time = None
+        self.fps = 30
+
+        start_time_str = self.metadata.get("creation_time", "")
+        if start_time_str:
+            self.start_time = parse(start_time_str)
+            self.start_time += relativedelta(hours=utc_offset)
+
+            if fps := self.metadata.get("com.android.capture.fps"):
+                self.fps = int(float(fps))
+            if fps and self.length_seconds:
+                self.finish_time = self.start_time + relativedelta(
+                    seconds=self.length_seconds / (self.fps / self.playback_framerate)
+                )
+
+
+def parse_seconds(text):
+    """Parses "90", "1:30" or "0:01:30.5" into seconds. Returns None for an
+    empty string."""
+    text = text.strip()
+    if not text:
+        return None
+    seconds = 0.0
+    for part in text.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+class VideoIndex:
+    """Presentation timestamps of every frame and of every keyframe in the
+    video, or in the window between start_seconds and end_seconds of it.
+    Built by demuxing packets only, which is far cheaper than decoding. With
+    a window, only the packets around the window are read."""
+
+    def __init__(self, file, start_seconds=None, end_seconds=None):
+        container = av.open(file)
+        try:
+            stream = container.streams.video[0]
+            self.time_base = stream.time_base
+            self.frame_width = stream.codec_context.width
+            self.frame_height = stream.codec_context.height
+            self.frame_rate = stream.average_rate or stream.base_rate
+            stream_start = stream.start_time or 0
+
+            packets = container.demux(stream)
+            start_pts = None
+            if start_seconds:
+                start_pts = stream_start + int(start_seconds / self.time_base)
+                packets = seek_frames(
+                    container, stream, start_pts, lambda: container.demux(stream)
+                )
+            end_pts = None
+            if end_seconds is not None:
+                end_pts = stream_start + int(end_seconds / self.time_base)
+                # Packets arrive in decode order, so keep reading a little
+                # past the end to pick up reordered frames
+                stop_pts = end_pts + int(1 / self.time_base)
+
+            pts = []
+            keyframes = []
+            for packet in packets:
+                if packet.pts is None:
+                    continue
+                if end_pts is not None and packet.pts > stop_pts:
+                    break
+                if packet.is_keyframe:
+                    keyframes.append(packet.pts)
+                if start_pts is not None and packet.pts < start_pts:
+                    continue
+                if end_pts is not None and packet.pts >= end_pts:
+                    continue
+                pts.append(packet.pts)
+        finally:
+            container.close()
+
+        self.set_timestamps(pts, keyframes, stream_start)
+
+    @classmethod
+    def from_frames(cls, stream, frames):
+        """Builds the index from the (pts, is_keyframe) pairs of frames that
+        were decoded anyway, so the video isn't read a second time"""
+        index = cls.__new__(cls)
+        index.time_base = stream.time_base
+        index.frame_width = stream.codec_context.width
+        index.frame_height = stream.codec_context.height
+        index.frame_rate = stream.average_rate or stream.base_rate
+        index.set_timestamps(
+            [pts for pts, _ in frames],
+            [pts for pts, is_keyframe in frames if is_keyframe],
+            stream.start_time or 0,
+        )
+        return index
+
+    def set_timestamps(self, pts, keyframes, stream_start):
+        # Sorting gives presentation order, so the position of a timestamp in
+        # this array is its frame number within the window.
+        self.pts = np.sort(np.array(pts, dtype=np.int64))
+        self.keyframes = sorted(keyframes)
+        self.num_frames = len(self.pts)
+        if not self.num_frames:
+            raise ValueError("There are no frames in the selected time window")
+
+        # Frame number of the first frame of the window within the whole
+        # video, used to offset the result's start time.
+        self.first_frame = round(
+            float((self.pts[0] - stream_start) * self.time_base * self.frame_rate)
+        )
+
+    def subset(self, start, stop):
+        """Returns an index of frames start to stop - 1 of this one. Every
+        keyframe is kept, so it can still be seeked around."""
+        index = copy.copy(self)
+        index.pts = self.pts[start:stop]
+        index.num_frames = len(index.pts)
+        index.first_frame = self.first_frame + start
+        return index
+
+    def frame_number(self, pts):
+        """Returns the frame number of a presentation timestamp, or None if
+        the frame isn't part of the index"""
+        if pts is None:
+            return None
+        i = int(np.searchsorted(self.pts, pts))
+        if i < self.num_frames and self.pts[i] == pts:
+            return i
+        return None
+
+    def segments(self, count):
+        """Splits the video into at most count keyframe aligned segments of
+        roughly equal length. Returns (first frame, last frame + 1) pairs."""
+        starts = sorted(
+            {int(np.searchsorted(self.pts, pts)) for pts in self.keyframes} | {0}
+        )
+        bounds = [0]
+        for i in range(1, count):
+            target = i * self.num_frames / count
+            start = starts[min(np.searchsorted(starts, target), len(starts) - 1)]
+            if bounds[-1] < start < self.num_frames:
+                bounds.append(start)
+        bounds.append(self.num_frames)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+
+# How far apart the end of one video and the start of the next may be and
+# still count as following straight on. Creation times only have whole
+# seconds. Stream timestamps are exact, give or take rounding.
+CREATION_TIME_TOLERANCE_SECONDS = 1
+TIMESTAMP_TOLERANCE_FRAMES = 1
+
+
+def timeline_offsets(files, indexes):
+    """Returns the frame number at which each of several consecutive videos
+    starts, on the timeline of the first one.
+
+    Where their stream timestamps carry on from one file to the next, as in
+    MPEG-TS, those place the files. Otherwise their creation times do, if
+    they all have one, and failing that every file is taken to follow
+    straight on from the one before. A gap between files is left as blank
+    columns. Raises ValueError if a file starts before the one before it
+    has ended."""
+    first_seconds = [float(index.pts[0] * index.time_base) for index in indexes]
+    infos = [VideoInfo(file) for file in files]
+    creation_times = [info.start_time for info in infos]
+    if all(b > a for a, b in zip(first_seconds, first_seconds[1:])):
+        rate = float(indexes[0].frame_rate)
+        starts = [(seconds - first_seconds[0]) * rate for seconds in first_seconds]
+        tolerance = TIMESTAMP_TOLERANCE_FRAMES
+    elif all(creation_times):
+        # Columns are captured frames, which slow motion video records the
+        # rate of. Otherwise they come at the stream's frame rate.
+        capture_fps = infos[0].metadata.get("com.android.capture.fps")
+        fps = float(capture_fps) if capture_fps else float(indexes[0].frame_rate)
+        starts = [
+            (creation_time - creation_times[0]).total_seconds() * fps
+            for creation_time in creation_times
+        ]
+        tolerance = CREATION_TIME_TOLERANCE_SECONDS * fps
+    else:
+        starts = None
+        tolerance = 0
+
+    offsets = [0]
+    for i in range(1, len(indexes)):
+        end = offsets[-1] + indexes[i - 1].num_frames
+        gap = starts[i] - end if starts else 0
+        if gap < -tolerance:
+            raise ValueError(
+                f"{os.path.basename(files[i])} starts before "
+                f"{os.path.basename(files[i - 1])} ends"
+            )
+        offsets.append(end + round(gap) if gap > tolerance else end)
+    return offsets
+
+
+class StitchedIndex:
+    """The VideoIndexes of consecutive videos, such as the chunks a camera
+    splits a long recording into, on one timeline. Frame numbers run on from
+    one file to the next, across any gap between them."""
+
+    first_frame = 0
+
+    def __init__(self, files, indexes, offsets=None):
+        self.files = list(files)
+        self.indexes = indexes
+        if offsets is None:
+            offsets = timeline_offsets(files, indexes)
+        # Frame number of the first frame of every file
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.num_frames = int(self.offsets[-1]) + indexes[-1].num_frames
+
+    def locate(self, frame_num):
+        """Returns which file frame frame_num is in, and its frame number
+        within that file. Frames in a gap after a file are past its end."""
+        i = int(np.searchsorted(self.offsets, frame_num, side="right")) - 1
+        i = min(max(i, 0), len(self.indexes) - 1)
+        return i, frame_num - int(self.offsets[i])
+
+
+def extract_segment(file, samplers, frame_pts):
+    """Decodes one keyframe aligned segment in its own container and samples
+    the lines from each of its frames. Runs in a worker process.
+
+    frame_pts holds the presentation timestamps of the segment's frames in
+    order. Returns a (height, len(frame_pts), 3) array of columns per line,
+    and the worker's ProcessingStats, or None if cancelled. Raises
+    ValueError if any of the frames couldn't be decoded."""
+    start = time.perf_counter()
+    stats = ProcessingStats()
+    columns = [
+        np.zeros((sampler.height, len(frame_pts), 3), dtype=np.uint8)
+        for sampler in samplers
+    ]
+    container = av.open(file)
+    try:
+        stream = container.streams.video[0]
+        first, last = int(frame_pts[0]), int(frame_pts[-1])
+        remaining = len(frame_pts)
+        for frame in timed_frames(seek_frames(container, stream, first), stats):
+            if worker_cancelled is not None and worker_cancelled.is_set():
+                return None
+            if frame.pts is None or frame.pts < first:
+                continue
+            if frame.pts > last:
+                # Frames of the next segment can be decoded before the last
+                # frames of this one, so only stop once everything is in.
+                if remaining <= 0:
+                    break
+                continue
+            i = int(np.searchsorted(frame_pts, frame.pts))
+            for line_columns, line in zip(columns, sample_lines(frame, samplers, stats)):
+                line_columns[:, i, :] = line
+            remaining -= 1
+            if remaining <= 0:
+                break
+    finally:
+        container.close()
+    if remaining > 0:
+        raise ValueError(
+            f"{remaining} of {len(frame_pts)} frames from pts {first} of "
+            f"{os.path.basename(file)} couldn't be decoded"
+        )
+    # The whole segment, decode included, is the worker's busy time
+    stats.busy_seconds = time.perf_counter() - start
+    return columns, stats
+
+
+def extract_segments(
+    file, index, samplers, result_arrays, direction,
+    is_cancelled=None, on_progress=None, workers=None, stats=None,
+):
+    """Decodes the video in parallel. Each worker process opens its own
+    container, seeks to a keyframe and decodes its segment independently.
+    Frames are placed by their presentation timestamp. Returns the number of
+    frames written, or None if cancelled. A cancel also stops the segments
+    the workers are in the middle of."""
+    workers = workers or os.cpu_count() or 1
+    stats = stats or ProcessingStats()
+    stats.workers = workers
+    cancelled = multiprocessing.Event()
+    # More segments than workers keeps the workers busy to the end and gives
+    # the progress bar something to show.
+    segments = index.segments(4 * workers)
+    num_frames = index.num_frames
+    frames_done = 0
+
+    # Every segment sends the same samplers, so they are only measured once
+    # rather than pickled again alongside each submit
+    samplers_bytes = len(pickle.dumps(samplers))
+
+    with make_executor("process", workers, cancelled) as executor:
+        futures = {}
+        for start, stop in segments:
+            pts = index.pts[start:stop]
+            futures[executor.submit(extract_segment, file, samplers, pts)] = (start, stop)
+            stats.ipc_bytes += samplers_bytes + pts.nbytes
+        try:
+            pending = set(futures)
+            while pending:
+                if is_cancelled and is_cancelled():
+                    cancelled.set()
+                    return None
+                done, pending = wait(pending, CANCEL_POLL_SECONDS, FIRST_COMPLETED)
+                stats.sample_queue_depth(len(pending) + len(done))
+                for future in done:
+                    start, stop = futures[future]
+                    segment_columns, worker_stats = future.result()
+                    stats.merge(worker_stats)
+                    stats.ipc_bytes += sum(
+                        columns.nbytes for columns in segment_columns
+                    )
+                    with stats.time("assemble"):
+                        for result_array, columns in zip(result_arrays, segment_columns):
+                            if direction > 0:
+                                # The result runs right to left, so the
+                                # segment goes in backwards.
+                                x = num_frames - stop
+                                result_array[:, x:x + stop - start, :] = columns[:, ::-1, :]
+                            else:
+                                result_array[:, start:stop, :] = columns
+                    frames_done += stop - start
+                if done and on_progress:
+                    on_progress(frames_done, num_frames)
+        finally:
+            for future in futures:
+                future.cancel()
+
+    return frames_done
+
+
+class ProcessedVideo:
+    """The outcome of process_video"""
+
+    def __init__(self, result_arrays, first_frame=0, stats=None, index=None):
+        # One (height, frames, 3) uint8 result per finish line
+        self.result_arrays = result_arrays
+        # Frame number, within the whole video, of the first processed frame
+        self.first_frame = first_frame
+        self.stats = stats or ProcessingStats()
+        # VideoIndex of the processed frames, for looking up the frame behind
+        # a column
+        self.index = index
+
+    @property
+    def result_array(self):
+        """The result of the first finish line"""
+        return self.result_arrays[0]
+
+
+def process_video(
+    file, lines, rotation, direction, interpolation="bilinear",
+    disk_backed=False, is_cancelled=None, on_progress=None, workers=None,
+    backend="auto", start_seconds=None, end_seconds=None, roi=None, downscale=1,
+):
+    """Constructs a result array per finish line from the video, in a single
+    decode pass.
+
+    lines is a list of (line_pos, theta) pairs describing each line as drawn
+    on the preview, after the video has been rotated by rotation degrees.
+    backend is "inline" to do all the work on the calling thread, "thread"
+    to sample frames on a thread pool while the calling thread decodes,
+    "process" to decode keyframe aligned segments in parallel processes, or
+    "auto" to let choose_backend pick. start_seconds and end_seconds limit
+    processing to a window of the video, which is seeked to directly. roi and
+    downscale limit the rows extracted, as described in LineSampler.
+    Returns a ProcessedVideo, or None if cancelled."""
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    stats = ProcessingStats()
+
+    container = av.open(file)
+    try:
+        stream = container.streams.video[0]
+        samplers = make_samplers(
+            stream.codec_context.width,
+            stream.codec_context.height,
+            lines,
+            rotation,
+            interpolation=interpolation,
+            roi=roi,
+            downscale=downscale,
+        )
+        if backend == "auto":
+            backend = choose_backend(
+                container, samplers, workers, start_seconds, end_seconds
+            )
+
+        index = None
+        # The frame count is missing from the metadata of some containers
+        if (
+            backend == "process"
+            or start_seconds
+            or end_seconds is not None
+            or not stream.frames
+        ):
+            with stats.time("index"):
+                index = VideoIndex(file, start_seconds, end_seconds)
+        num_frames = index.num_frames if index is not None else int(stream.frames)
+        with stats.time("allocate"):
+            result_arrays = [
+                allocate_result_array(sampler.height, num_frames, disk_backed=disk_backed)
+                for sampler in samplers
+            ]
+
+        # Without an index, one is recorded from the frames as they decode
+        timestamps = [] if index is None else None
+        frames_done, backend = extract_file(
+            file,
+            index,
+            samplers,
+            result_arrays,
+            direction,
+            backend=backend,
+            is_cancelled=is_cancelled,
+            on_progress=on_progress,
+            workers=workers,
+            stats=stats,
+            timestamps=timestamps,
+        )
+        if timestamps and None not in (pts for pts, _ in timestamps):
+            index = VideoIndex.from_frames(stream, timestamps)
+    finally:
+        container.close()
+
+    if frames_done is None:
+        return None
+    stats.backend = backend
+    stats.frames = frames_done
+    stats.wall_seconds = time.perf_counter() - start
+    return ProcessedVideo(
+        result_arrays, index.first_frame if index else 0, stats, index
+    )
+
+
+def extract_file(
+    file, index, samplers, result_arrays, direction, backend="auto",
+    is_cancelled=None, on_progress=None, workers=None, stats=None,
+    timestamps=None,
+):
+    """Extracts the frames in the VideoIndex of a file into result arrays as
+    wide as it. With no index, every frame of the file is extracted, up to
+    the width of the result arrays, and the process backend isn't used. If a
+    timestamps list is given, the (pts, is_keyframe) pair of every frame
+    written is appended to it, as in extract_columns. Returns the number of
+    frames written, or None if cancelled, and the backend used."""
+    workers = workers or os.cpu_count() or 1
+    container = av.open(file)
+    try:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        if backend == "auto":
+            backend = choose_backend(container, samplers, workers)
+        if backend == "process" and (index is None or len(index.keyframes) < 2):
+            # Too few keyframes to split the work up
+            backend = "thread"
+        if backend != "process":
+            if index is None:
+                frames = container.decode(stream)
+                num_frames = result_arrays[0].shape[1]
+            else:
+                frames = seek_frames(container, stream, int(index.pts[0]))
+                num_frames = index.num_frames
+            frames_done = extract_columns(
+                frames,
+                samplers,
+                result_arrays,
+                direction,
+                num_frames,
+                is_cancelled=is_cancelled,
+                on_progress=on_progress,
+                workers=workers,
+                index=index,
+                stats=stats,
+                timestamps=timestamps,
+                backend=backend,
+            )
+            return frames_done, backend
+    finally:
+        container.close()
+
+    frames_done = extract_segments(
+        file,
+        index,
+        samplers,
+        result_arrays,
+        direction,
+        is_cancelled=is_cancelled,
+        on_progress=on_progress,
+        workers=workers,
+        stats=stats,
+    )
+    return frames_done, backend
+
+
+def process_files(
+    files, lines, rotation, direction, interpolation="bilinear",
+    disk_backed=False, is_cancelled=None, on_progress=None, workers=None,
+    backend="auto", roi=None, downscale=1,
+):
+    """Constructs a result array per finish line from consecutive videos, as
+    if they were one. The files are decoded one after another straight into
+    the same result arrays, so they never have to be joined on disk. Frames
+    are placed by their presentation timestamps within each file, and files
+    are placed on one timeline as described in timeline_offsets. The videos
+    must all have the same frame size.
+
+    Takes the same arguments as process_video, apart from the window.
+    Returns a ProcessedVideo with a StitchedIndex, or None if cancelled."""
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    stats = ProcessingStats()
+
+    with stats.time("index"):
+        indexes = [VideoIndex(file) for file in files]
+    sizes = {(index.frame_width, index.frame_height) for index in indexes}
+    if len(sizes) > 1:
+        raise ValueError("The videos must all have the same frame size")
+    frame_width, frame_height = sizes.pop()
+    index = StitchedIndex(files, indexes)
+    num_frames = index.num_frames
+
+    samplers = make_samplers(
+        frame_width,
+        frame_height,
+        lines,
+        rotation,
+        interpolation=interpolation,
+        roi=roi,
+        downscale=downscale,
+    )
+    with stats.time("allocate"):
+        result_arrays = [
+            allocate_result_array(sampler.height, num_frames, disk_backed=disk_backed)
+            for sampler in samplers
+        ]
+
+    backends = []
+    frames_done = 0
+    for file, file_index, offset in zip(files, indexes, index.offsets):
+        offset = int(offset)
+        stop = offset + file_index.num_frames
+        if direction > 0:
+            # The result runs right to left, so earlier files go further right
+            left, right = num_frames - stop, num_frames - offset
+        else:
+            left, right = offset, stop
+
+        def file_progress(done, total, offset=offset):
+            if on_progress:
+                on_progress(offset + done, num_frames)
+
+        file_frames_done, file_backend = extract_file(
+            file,
+            file_index,
+            samplers,
+            [result_array[:, left:right] for result_array in result_arrays],
+            direction,
+            backend=backend,
+            is_cancelled=is_cancelled,
+            on_progress=file_progress,
+            workers=workers,
+            stats=stats,
+        )
+        if file_frames_done is None:
+            return None
+        frames_done += file_frames_done
+        if file_backend not in backends:
+            backends.append(file_backend)
+
+    stats.backend = ",".join(backends)
+    stats.frames = frames_done
+    stats.wall_seconds = time.perf_counter() - start
+    return ProcessedVideo(result_arrays, 0, stats, index)
+
+
+# Decoded frames kept by a FrameSource for quick lookups near the cursor,
+# and the most memory they may take
+FRAME_CACHE_SIZE = 32
+FRAME_CACHE_BYTES = 64 * 2**20
+
+
+class FrameSource:
+    """Random access to the frames behind a result, by frame number within
+    its VideoIndex.
+
+    A cold lookup seeks to the nearest keyframe before the frame and decodes
+    forward from there. The frames around the one asked for are kept in a
+    small least recently used cache, and moving forward within a group of
+    pictures carries on decoding where the last lookup stopped, so small
+    cursor moves don't decode anything again. Frames are shrunk to fit in
+    max_size, a (width, height) after rotation, as they are converted. Safe
+    to use from several threads."""
+
+    def __init__(
+        self, file, index, rotation=0, cache_size=FRAME_CACHE_SIZE, max_size=None,
+    ):
+        self.file = file
+        self.index = index
+        self.rotation = rotation
+        self.cache_size = cache_size
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.lock = Lock()
+        self.container = None
+        self.stream = None
+        self.frames = None
+        # pts of the last frame decoded from self.frames
+        self.position = None
+
+    def frame(self, frame_num):
+        """Returns frame frame_num as a PIL image, rotated like the preview"""
+        frame_num = min(max(frame_num, 0), self.index.num_frames - 1)
+        with self.lock:
+            if frame_num in self.cache:
+                self.cache.move_to_end(frame_num)
+                return self.cache[frame_num]
+            return self.decode(frame_num)
+
+    def decode(self, frame_num):
+        target = int(self.index.pts[frame_num])
+        keyframe_num = np.searchsorted(self.index.keyframes, target, side="right") - 1
+        keyframe = self.index.keyframes[max(keyframe_num, 0)]
+        if self.container is None:
+            self.container = av.open(self.file)
+            self.stream = self.container.streams.video[0]
+            self.stream.thread_type = "AUTO"
+        # Carry on from the last lookup if no keyframe lies in between
+        if self.position is None or not keyframe <= self.position < target:
+            self.frames = seek_frames(
+                self.container, self.stream, keyframe, rewind=True
+            )
+
+        image = None
+        for frame in self.frames:
+            if frame.pts is None:
+                continue
+            self.position = frame.pts
+            num = self.index.frame_number(frame.pts)
+            # Only the frames near the one asked for are worth converting
+            if num is not None and abs(num - frame_num) < self.cache_size // 2:
+                self.store(num, frame)
+            if frame.pts >= target:
+                image = self.cache.get(frame_num)
+                break
+        if image is None:
+            raise ValueError(f"Frame {frame_num} couldn't be decoded")
+        return image
+
+    def store(self, frame_num, frame):
+        width, height = frame.width, frame.height
+        if self.max_size:
+            max_width, max_height = self.max_size
+            if self.rotation % 180:
+                max_width, max_height = max_height, max_width
+            scale = min(max_width / width, max_height / height, 1)
+            width = max(round(width * scale), 1)
+            height = max(round(height * scale), 1)
+        image = frame.reformat(width, height, format="rgb24").to_image()
+        if self.rotation % 360:
+            image = image.rotate(self.rotation, expand=True)
+        if frame_num in self.cache:
+            self.cache_bytes -= image_bytes(self.cache.pop(frame_num))
+        self.cache[frame_num] = image
+        self.cache_bytes += image_bytes(image)
+        while len(self.cache) > 1 and (
+            len(self.cache) > self.cache_size or self.cache_bytes > FRAME_CACHE_BYTES
+        ):
+            self.cache_bytes -= image_bytes(self.cache.popitem(last=False)[1])
+
+    def resident_bytes(self):
+        return self.cache_bytes
+
+    def clear(self):
+        """Drops the cached frames"""
+        with self.lock:
+            self.cache.clear()
+            self.cache_bytes = 0
+
+    def close(self):
+        with self.lock:
+            if self.container is not None:
+                self.container.close()
+                self.container = None
+                self.position = None
+
+
+def image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class StitchedFrameSource:
+    """Random access to the frames behind a result of consecutive videos,
+    by frame number within its StitchedIndex, through a FrameSource per
+    file"""
+
+    def __init__(self, index, rotation=0, cache_size=FRAME_CACHE_SIZE, max_size=None):
+        self.index = index
+        self.sources = [
+            FrameSource(file, file_index, rotation, cache_size, max_size)
+            for file, file_index in zip(index.files, index.indexes)
+        ]
+
+    def frame(self, frame_num):
+        """Returns frame frame_num as a PIL image, rotated like the preview"""
+        frame_num = min(max(frame_num, 0), self.index.num_frames - 1)
+        i, file_frame_num = self.index.locate(frame_num)
+        if file_frame_num >= self.index.indexes[i].num_frames:
+            raise ValueError(f"Frame {frame_num} is in a gap between videos")
+        return self.sources[i].frame(file_frame_num)
+
+    def resident_bytes(self):
+        return sum(source.resident_bytes() for source in self.sources)
+
+    def clear(self):
+        for source in self.sources:
+            source.clear()
+
+    def close(self):
+        for source in self.sources:
+            source.close()
@@ -0,0 +1,49 @@
+"""Keeps the pixels of the results open in a session within a memory budget.
+
+Results that haven't been looked at for the longest are evicted first: their
+pixels move to a memory-mapped temporary file and anything derived from them,
+like zoom levels, is dropped until they are looked at again. Everything else
+about an evicted result, its timing and cursor, keeps working.
+
+The store works on any object with resident_bytes(), evict() and reload()
+methods."""
+
+
+# Default memory budget for result pixels, in bytes
+DEFAULT_MEMORY_BUDGET = 2 * 2**30
+
+
+class ResultStore:
+    def __init__(self, budget_bytes=DEFAULT_MEMORY_BUDGET):
+        self.budget_bytes = budget_bytes
+        # Least recently used first
+        self.results = []
+
+    def add(self, result):
+        """Adds a result as the most recently used one"""
+        self.results.append(result)
+        self.enforce()
+
+    def remove(self, result):
+        if result in self.results:
+            self.results.remove(result)
+
+    def touch(self, result):
+        """Marks a result as being looked at, reloading it if it was
+        evicted"""
+        self.remove(result)
+        self.results.append(result)
+        result.reload()
+        self.enforce()
+
+    def resident_bytes(self):
+        return sum(result.resident_bytes() for result in self.results)
+
+    def enforce(self):
+        """Evicts the least recently used results until the rest fit in the
+        budget. The most recently used result is never evicted."""
+        total = self.resident_bytes()
+        for result in self.results[:-1]:
+            if total <= self.budget_bytes:
+                break
+            total -= result.evict()
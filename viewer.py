@@ -0,0 +1,275 @@
+"""A viewer for result images that are far too wide to hand to Tk in one piece.
+
+Only the part of the result that is visible on the canvas is ever converted to
+a PhotoImage. Zoomed out views are served from a multi-resolution pyramid that
+is built in the background, so opening a result is instant."""
+import math
+from threading import Thread
+import tkinter as tk
+from tkinter import ttk
+
+from PIL import Image, ImageTk
+import numpy as np
+
+
+# Zoom factors, in screen pixels per result pixel, offered when zooming in
+MAX_ZOOM = 8
+
+# Stop building pyramid levels once they are narrower than this
+MIN_LEVEL_WIDTH = 256
+
+# Number of columns averaged at a time when building a pyramid level. Keeps
+# the temporary arrays small for very long results.
+DOWNSAMPLE_CHUNK = 8192
+
+
+def downsample(array):
+    """Halves the width and height of a (height, width, 3) uint8 array by
+    averaging 2x2 blocks. Odd edges are averaged with themselves."""
+    height, width = array.shape[:2]
+    out = np.empty(((height + 1) // 2, (width + 1) // 2, 3), dtype=np.uint8)
+    for start in range(0, width, DOWNSAMPLE_CHUNK):
+        block = np.asarray(array[:, start:start + DOWNSAMPLE_CHUNK])
+        if block.shape[0] % 2:
+            block = np.concatenate([block, block[-1:]], axis=0)
+        if block.shape[1] % 2:
+            block = np.concatenate([block, block[:, -1:]], axis=1)
+        total = block[0::2, 0::2].astype(np.uint16)
+        total += block[1::2, 0::2]
+        total += block[0::2, 1::2]
+        total += block[1::2, 1::2]
+        total += 2
+        total >>= 2
+        out[:, start // 2:start // 2 + total.shape[1]] = total
+    return out
+
+
+class ImagePyramid:
+    """Level 0 is the result itself, every following level is half the size of
+    the one before it. Levels are built on a background thread. Until a level
+    is ready it is approximated with a strided view of the finest level that
+    is.
+
+    Pass build=False for results that are about to be replaced, like a live
+    result that is still growing. Every level is then a strided view."""
+
+    def __init__(self, array, build=True):
+        self.levels = [array]
+        self.num_levels = 1
+        width = array.shape[1]
+        while width > MIN_LEVEL_WIDTH:
+            width = (width + 1) // 2
+            self.num_levels += 1
+
+        if build:
+            Thread(target=self.build, daemon=True).start()
+
+    def build(self):
+        while len(self.levels) < self.num_levels:
+            self.levels.append(downsample(self.levels[-1]))
+
+    def resident_bytes(self):
+        """Returns the memory taken by the levels built so far"""
+        return sum(level.nbytes for level in self.levels[1:])
+
+    def level(self, n):
+        """Returns level n of the pyramid"""
+        n = min(n, self.num_levels - 1)
+        levels = self.levels
+        if n < len(levels):
+            return levels[n]
+
+        step = 2 ** (n - len(levels) + 1)
+        return levels[-1][::step, ::step]
+
+
+class TiledViewer:
+    """A scrollable, zoomable canvas showing a result array with a cursor.
+
+    All positions passed in and out are columns of the full resolution
+    result, so cursor to time mapping is exact at every zoom level."""
+
+    def __init__(self, parent, array, on_click=None):
+        self.array = array
+        self.height, self.width = array.shape[:2]
+        self.pyramid = ImagePyramid(array)
+        self.on_click = on_click
+
+        # The zoom is 2 ** zoom_exponent screen pixels per result pixel
+        self.zoom_exponent = 0
+        # Top left corner of the view, in full resolution result pixels
+        self.x0 = 0.0
+        self.y0 = 0.0
+        self.cursor_column = 0
+
+        self.canvas = tk.Canvas(parent, highlightthickness=0)
+        self.hbar = ttk.Scrollbar(parent, orient=tk.HORIZONTAL, command=self.xview)
+        self.hbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.vbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.yview)
+        self.vbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.tk_image = None
+        self.image_size = None
+        self.image = self.canvas.create_image(0, 0, anchor=tk.NW)
+        self.cursor = self.canvas.create_line(0, 0, 0, 0, width=1, fill="#ffffff")
+
+        self.canvas.bind("<Configure>", lambda event: self.render())
+        self.canvas.bind("<Button-1>", self.clicked)
+        self.canvas.bind("<MouseWheel>", self.wheel)
+        self.canvas.bind("<Control-MouseWheel>", self.wheel_zoom)
+        # Linux reports the mouse wheel as buttons 4 and 5
+        self.canvas.bind("<Button-4>", lambda event: self.scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda event: self.scroll(1, "units"))
+        self.canvas.bind("<Control-Button-4>", lambda event: self.zoom(1, event.x))
+        self.canvas.bind("<Control-Button-5>", lambda event: self.zoom(-1, event.x))
+
+    def set_array(self, array, build_pyramid=True, added_before=0):
+        """Replaces the result being shown, e.g. when a live result has grown.
+        added_before is the number of columns added in front of the old ones,
+        so that the view stays on the same part of the result."""
+        self.array = array
+        self.height, self.width = array.shape[:2]
+        self.pyramid = ImagePyramid(array, build=build_pyramid)
+        self.x0 += added_before
+        self.cursor_column = min(self.cursor_column + added_before, self.width - 1)
+        self.render()
+
+    def pack(self, **kwargs):
+        self.canvas.pack(**kwargs)
+
+    @property
+    def scale(self):
+        return 2.0 ** self.zoom_exponent
+
+    def view_size(self):
+        """Returns the width and height of the view in result pixels"""
+        return (
+            max(self.canvas.winfo_width(), 1) / self.scale,
+            max(self.canvas.winfo_height(), 1) / self.scale,
+        )
+
+    def clamp(self):
+        view_width, view_height = self.view_size()
+        self.x0 = min(max(self.x0, 0), max(self.width - view_width, 0))
+        self.y0 = min(max(self.y0, 0), max(self.height - view_height, 0))
+
+    def column_at(self, canvas_x):
+        """Returns the result column under a canvas x coordinate"""
+        column = int(self.x0 + canvas_x / self.scale)
+        return min(max(column, 0), self.width - 1)
+
+    def render(self):
+        """Draws the visible part of the result onto the canvas"""
+        self.clamp()
+        canvas_width = max(self.canvas.winfo_width(), 1)
+        canvas_height = max(self.canvas.winfo_height(), 1)
+
+        if self.zoom_exponent < 0:
+            level = -self.zoom_exponent
+            array = self.pyramid.level(level)
+            step = 2 ** level
+            x = int(self.x0) // step
+            y = int(self.y0) // step
+            # Snap to the level's pixel grid so columns map back exactly
+            self.x0 = x * step
+            self.y0 = y * step
+            view = array[y:y + canvas_height, x:x + canvas_width]
+        else:
+            repeat = 2 ** self.zoom_exponent
+            x = int(self.x0)
+            y = int(self.y0)
+            view = self.array[
+                y:y + math.ceil(canvas_height / repeat) + 1,
+                x:x + math.ceil(canvas_width / repeat) + 1,
+            ]
+            if repeat > 1:
+                view = np.repeat(np.repeat(view, repeat, axis=0), repeat, axis=1)
+            # Keep the fractional part of the scroll position
+            offset_x = int((self.x0 - x) * repeat)
+            offset_y = int((self.y0 - y) * repeat)
+            view = view[
+                offset_y:offset_y + canvas_height, offset_x:offset_x + canvas_width
+            ]
+
+        image = Image.fromarray(np.ascontiguousarray(view), mode="RGB")
+        if self.tk_image is not None and self.image_size == image.size:
+            self.tk_image.paste(image)
+        else:
+            self.tk_image = ImageTk.PhotoImage(image)
+            self.image_size = image.size
+            self.canvas.itemconfig(self.image, image=self.tk_image)
+
+        self.draw_cursor()
+        view_width, view_height = self.view_size()
+        self.hbar.set(self.x0 / self.width, (self.x0 + view_width) / self.width)
+        self.vbar.set(self.y0 / self.height, (self.y0 + view_height) / self.height)
+
+    def draw_cursor(self):
+        x = (self.cursor_column + 0.5 - self.x0) * self.scale
+        self.canvas.coords(
+            self.cursor, x, 0, x, (self.height - self.y0) * self.scale
+        )
+
+    def set_cursor(self, column):
+        """Moves the cursor to a result column, scrolling it into view if
+        needed"""
+        self.cursor_column = column
+        view_width = self.view_size()[0]
+        if not self.x0 <= column < self.x0 + view_width:
+            self.x0 = column - view_width / 2
+            self.render()
+        else:
+            self.draw_cursor()
+
+    def zoom(self, steps, canvas_x=None):
+        """Zooms in (positive steps) or out, keeping the column under
+        canvas_x, or the cursor, in place"""
+        min_exponent = -(self.pyramid.num_levels - 1)
+        exponent = min(
+            max(self.zoom_exponent + steps, min_exponent), int(math.log2(MAX_ZOOM))
+        )
+        if exponent == self.zoom_exponent:
+            return
+
+        if canvas_x is None:
+            anchor = self.cursor_column + 0.5
+            canvas_x = (anchor - self.x0) * self.scale
+        else:
+            anchor = self.x0 + canvas_x / self.scale
+        self.zoom_exponent = exponent
+        self.x0 = anchor - canvas_x / self.scale
+        self.render()
+
+    def scroll(self, number, what):
+        view_width = self.view_size()[0]
+        if what == "pages":
+            self.x0 += number * view_width * 0.9
+        else:
+            self.x0 += number * view_width / 10
+        self.render()
+
+    def xview(self, *args):
+        if args[0] == "moveto":
+            self.x0 = float(args[1]) * self.width
+            self.render()
+        elif args[0] == "scroll":
+            self.scroll(int(args[1]), args[2])
+
+    def yview(self, *args):
+        view_height = self.view_size()[1]
+        if args[0] == "moveto":
+            self.y0 = float(args[1]) * self.height
+        elif args[0] == "scroll":
+            step = view_height * 0.9 if args[2] == "pages" else view_height / 10
+            self.y0 += int(args[1]) * step
+        self.render()
+
+    def clicked(self, event):
+        if self.on_click:
+            self.on_click(self.column_at(event.x))
+
+    def wheel(self, event):
+        self.scroll(-1 if event.delta > 0 else 1, "units")
+
+    def wheel_zoom(self, event):
+        self.zoom(1 if event.delta > 0 else -1, event.x)